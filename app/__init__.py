@@ -5,7 +5,22 @@ from flask_migrate import Migrate
 from flask_wtf.csrf import CSRFProtect
 from flask_caching import Cache
 from config import Config
-from app.models import db, User
+from app.models import db
+from app.services.health import health
+from app.services.upstream import upstream
+from app.services.singleflight import singleflight
+from app.services.image_cache import image_cache
+from app.services.video_cache import video_cache
+from app.services.background import background, mirror_jobs
+from app.services.subtitles import subtitles
+from app.services.faststart import faststart
+from app.services.view_counter import view_counter
+from app.services.stamps import stamps
+from app.services.site_settings import site_settings
+from app.services.user_cache import user_cache
+from app.services.search import search_index
+from app.services.episode_index import episode_index
+from app.services.query_budget import query_budget
 
 login_manager = LoginManager()
 login_manager.login_view = 'auth.login'
@@ -15,7 +30,7 @@ cache = Cache()
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return user_cache.get(int(user_id))
 
 def create_app(config_class=Config):
     app = Flask(__name__)
@@ -27,14 +42,29 @@ def create_app(config_class=Config):
     migrate.init_app(app, db)
     csrf.init_app(app)
     cache.init_app(app)
+    health.init_app(app)
+    upstream.init_app(app)
+    singleflight.init_app(app)
+    image_cache.init_app(app)
+    video_cache.init_app(app)
+    background.init_app(app)
+    mirror_jobs.init_app(app)
+    subtitles.init_app(app)
+    faststart.init_app(app)
+    view_counter.init_app(app)
+    stamps.init_app(app)
+    site_settings.init_app(app)
+    user_cache.init_app(app)
+    search_index.init_app(app)
+    episode_index.init_app(app)
+    query_budget.init_app(app)
 
     @app.context_processor
     def inject_global_vars():
         from datetime import datetime
-        from app.models import SiteSettings
         return {
             'now': datetime.now(),
-            'site_settings': SiteSettings.query.first()
+            'site_settings': site_settings.get()
         }
 
     # Register Blueprints
@@ -52,4 +82,7 @@ def create_app(config_class=Config):
     app.register_blueprint(payment_bp, url_prefix='/payment')
     app.register_blueprint(webhook_bp, url_prefix='/webhook')
 
+    from app.commands import register_commands
+    register_commands(app)
+
     return app
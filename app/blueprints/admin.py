@@ -1,16 +1,31 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app, Response, stream_with_context
+from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app, Response, stream_with_context, jsonify, send_file
 from flask_login import login_required, current_user
 from werkzeug.utils import secure_filename
-from app.models import db, Movie, Episode, User, Transaction, SubscriptionPlan, SiteSettings
+from app.models import db, Movie, Episode, User, Transaction, SubscriptionPlan, SiteSettings, LinkProbe, EpisodeMirror
 from app.decorators import admin_required
 from datetime import datetime, timedelta
-from sqlalchemy import func
+from sqlalchemy.orm import selectinload
 import os
 import requests
-import urllib3
-
-# Suppress InsecureRequestWarning
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+from urllib.parse import urlencode
+from app.services.upstream import upstream, iter_response, forward_headers
+from app.services.image_cache import image_cache
+from app.services.video_cache import video_cache
+from app.services.singleflight import singleflight
+from app.services.view_counter import view_counter
+from app.services.site_settings import site_settings
+from app.services.user_cache import user_cache
+from app.services.search import search_index
+from app.pagination import keyset_paginate, forget_count, cached_count
+from app.services.episode_index import episode_index
+from app.services.stats import record_payment, summary as stats_summary
+from app.services.subtitles import convert_movie
+from app.streaming import sign_download
+from app.services.offload import offload_file, offload_upstream
+from app.services.background import background, mirror_jobs
+from app.services.prober import probe_movie, link_status
+from app.services.faststart import scan_episode_id
+from app.services.mirror import mirror_episode, mirrored_source, mirrored_path, remove_local_copies
 
 admin_bp = Blueprint('admin', __name__)
 
@@ -24,11 +39,11 @@ def allowed_file(filename):
 @login_required
 @admin_required
 def dashboard():
-    total_users = User.query.count()
-    total_movies = Movie.query.count()
-    total_transactions = Transaction.query.count()
-    total_omset = db.session.query(func.sum(Transaction.amount)).filter(Transaction.status == 'paid').scalar() or 0
-    return render_template('admin/dashboard.html', total_users=total_users, total_movies=total_movies, total_transactions=total_transactions, total_omset=total_omset)
+    stats = stats_summary(days=30)
+    total_movies = cached_count('movies', Movie.query)
+    return render_template('admin/dashboard.html', stats=stats, total_users=stats['total_users'],
+                           total_movies=total_movies, total_transactions=stats['total_transactions'],
+                           total_omset=stats['total_revenue'])
 
 @admin_bp.route('/settings', methods=['GET', 'POST'])
 @login_required
@@ -39,6 +54,7 @@ def settings():
         settings = SiteSettings(site_title="DracinLovers")
         db.session.add(settings)
         db.session.commit()
+        site_settings.invalidate()
     
     if request.method == 'POST':
         settings.site_title = request.form.get('site_title')
@@ -66,6 +82,7 @@ def settings():
                 settings.logo_url = url_for('static', filename=f'uploads/assets/{filename}')
         
         db.session.commit()
+        site_settings.invalidate()
         flash('Site settings updated successfully', 'success')
         return redirect(url_for('admin.settings'))
         
@@ -80,11 +97,11 @@ def movies():
     page = request.args.get('page', 1, type=int)
     search_query = request.args.get('q', '')
     
-    query = Movie.query
     if search_query:
-        query = query.filter(Movie.title.ilike(f'%{search_query}%'))
-        
-    movies = query.order_by(Movie.created_at.desc()).paginate(page=page, per_page=20)
+        # Ranked results are paged by number over the in-memory result list
+        movies = search_index.paginate(search_query, page=page, per_page=current_app.config['ADMIN_PER_PAGE'])
+    else:
+        movies = keyset_paginate(Movie.query, Movie, per_page=current_app.config['ADMIN_PER_PAGE'], count_key='movies')
     return render_template('admin/movies.html', movies=movies, search_query=search_query)
 
 @admin_bp.route('/movies/add', methods=['GET', 'POST'])
@@ -99,6 +116,8 @@ def add_movie():
         movie = Movie(title=title, description=description, poster_url=poster_url)
         db.session.add(movie)
         db.session.commit()
+        search_index.update(movie)
+        forget_count('movies')
         flash('Movie added successfully', 'success')
         return redirect(url_for('admin.movies'))
     return render_template('admin/movie_form.html')
@@ -114,6 +133,7 @@ def edit_movie(id):
         movie.poster_url = request.form.get('poster_url')
         
         db.session.commit()
+        search_index.update(movie)
         flash('Movie updated successfully', 'success')
         return redirect(url_for('admin.movies'))
     return render_template('admin/movie_form.html', movie=movie)
@@ -124,9 +144,17 @@ def edit_movie(id):
 def delete_movie(id):
     movie = Movie.query.get_or_404(id)
     # Delete associated episodes first or let cascade handle it if configured (not configured in models, so manual delete)
+    episode_ids = db.session.query(Episode.id).filter_by(movie_id=id)
+    sources = [url for episode in Episode.query.filter_by(movie_id=id) for url in episode.sources]
+    LinkProbe.query.filter(LinkProbe.episode_id.in_(episode_ids)).delete(synchronize_session=False)
+    EpisodeMirror.query.filter(EpisodeMirror.episode_id.in_(episode_ids)).delete(synchronize_session=False)
     Episode.query.filter_by(movie_id=id).delete()
     db.session.delete(movie)
     db.session.commit()
+    remove_local_copies(sources)
+    search_index.remove(id)
+    episode_index.invalidate()
+    forget_count('movies')
     flash('Movie deleted successfully', 'success')
     return redirect(url_for('admin.movies'))
 
@@ -137,8 +165,19 @@ def delete_movie(id):
 @admin_required
 def movie_episodes(movie_id):
     movie = Movie.query.get_or_404(movie_id)
-    episodes = Episode.query.filter_by(movie_id=movie_id).order_by(Episode.episode_number.asc()).all()
-    return render_template('admin/episodes.html', movie=movie, episodes=episodes)
+    episodes = Episode.query.options(selectinload(Episode.probes), selectinload(Episode.mirror)).filter_by(movie_id=movie_id).order_by(Episode.episode_number.asc()).all()
+    return render_template('admin/episodes.html', movie=movie, episodes=episodes, link_status=link_status)
+
+@admin_bp.route('/movies/<int:movie_id>/probe-links', methods=['POST'])
+@login_required
+@admin_required
+def probe_movie_links(movie_id):
+    Movie.query.get_or_404(movie_id)
+    if background.submit_once(f'probe-links:{movie_id}', probe_movie, movie_id):
+        flash('Link check started; refresh this page in a minute to see the results', 'success')
+    else:
+        flash('A link check is already running', 'error')
+    return redirect(url_for('admin.movie_episodes', movie_id=movie_id))
 
 @admin_bp.route('/movies/<int:movie_id>/episodes/add', methods=['GET', 'POST'])
 @login_required
@@ -149,6 +188,7 @@ def add_episode(movie_id):
         title = request.form.get('title')
         episode_number = request.form.get('episode_number')
         video_url = request.form.get('video_url')
+        mirror_urls = request.form.get('mirror_urls', '').strip()
         is_free = request.form.get('is_free') == 'on'
         
         episode = Episode(
@@ -156,10 +196,14 @@ def add_episode(movie_id):
             title=title,
             episode_number=episode_number,
             video_url=video_url,
+            mirror_urls=mirror_urls or None,
             is_free=is_free
         )
         db.session.add(episode)
+        movie.refresh_episode_stats()
         db.session.commit()
+        episode_index.invalidate()
+        _schedule_faststart_scan(episode)
         flash('Episode added successfully', 'success')
         return redirect(url_for('admin.movie_episodes', movie_id=movie_id))
     return render_template('admin/episode_form.html', movie=movie)
@@ -170,27 +214,81 @@ def add_episode(movie_id):
 def edit_episode(id):
     episode = Episode.query.get_or_404(id)
     if request.method == 'POST':
+        old_sources = episode.sources
         episode.title = request.form.get('title')
         episode.episode_number = request.form.get('episode_number')
         episode.video_url = request.form.get('video_url')
+        episode.mirror_urls = request.form.get('mirror_urls', '').strip() or None
         episode.is_free = request.form.get('is_free') == 'on'
+        episode.movie.refresh_episode_stats()
+        dropped = [url for url in old_sources if url not in episode.sources]
+        if episode.mirror and episode.mirror.source_url in dropped:
+            db.session.delete(episode.mirror)
         
         db.session.commit()
+        # Local copies of removed URLs would otherwise stay on disk for good
+        remove_local_copies(dropped)
+        episode_index.invalidate()
+        _schedule_faststart_scan(episode)
         flash('Episode updated successfully', 'success')
         return redirect(url_for('admin.movie_episodes', movie_id=episode.movie_id))
     return render_template('admin/episode_form.html', episode=episode, movie=episode.movie)
 
+@admin_bp.route('/episodes/<int:id>/mirror', methods=['POST'])
+@login_required
+@admin_required
+def mirror_episode_files(id):
+    episode = Episode.query.get_or_404(id)
+    if mirror_jobs.submit_once(f'mirror:{episode.id}', mirror_episode, episode.id):
+        flash(f'Mirroring episode {episode.episode_number} to local storage', 'success')
+    else:
+        flash('This episode is already queued for mirroring', 'error')
+    return redirect(url_for('admin.movie_episodes', movie_id=episode.movie_id))
+
+@admin_bp.route('/movies/<int:movie_id>/mirror', methods=['POST'])
+@login_required
+@admin_required
+def mirror_movie_files(movie_id):
+    Movie.query.get_or_404(movie_id)
+    episode_ids = [episode_id for (episode_id,) in db.session.query(Episode.id).filter_by(movie_id=movie_id).order_by(Episode.episode_number)]
+    queued = sum(1 for episode_id in episode_ids
+                 if mirror_jobs.submit_once(f'mirror:{episode_id}', mirror_episode, episode_id))
+    flash(f'Queued {queued} episodes for mirroring', 'success')
+    return redirect(url_for('admin.movie_episodes', movie_id=movie_id))
+
+def _schedule_faststart_scan(episode):
+    # Check the MP4 layout (and fix moov-at-end files) before the first viewer
+    if current_app.config.get('FASTSTART_SCAN_ON_SAVE'):
+        background.submit_once(f'faststart:{episode.id}', scan_episode_id, episode.id)
+
 @admin_bp.route('/episodes/delete/<int:id>', methods=['POST'])
 @login_required
 @admin_required
 def delete_episode(id):
     episode = Episode.query.get_or_404(id)
     movie_id = episode.movie_id
+    movie = episode.movie
+    sources = episode.sources
     db.session.delete(episode)
+    movie.refresh_episode_stats()
     db.session.commit()
+    remove_local_copies(sources)
+    episode_index.invalidate()
     flash('Episode deleted successfully', 'success')
     return redirect(url_for('admin.movie_episodes', movie_id=movie_id))
 
+@admin_bp.route('/movies/<int:movie_id>/subtitles/convert', methods=['POST'])
+@login_required
+@admin_required
+def convert_subtitles(movie_id):
+    movie = Movie.query.get_or_404(movie_id)
+    # A long series takes longer than a worker may hold a request
+    if background.submit_once(f'subtitles:{movie_id}', convert_movie, movie_id):
+        flash(f"Subtitle conversion for {movie.title} queued; failures are written to the log", 'success')
+    else:
+        flash('Subtitle conversion is already queued for this movie', 'error')
+    return redirect(url_for('admin.movie_episodes', movie_id=movie_id))
+
 @admin_bp.route('/episodes/download/<int:id>')
 @login_required
 @admin_required
@@ -202,35 +300,38 @@ def download_episode(id):
         flash('No video URL found for this episode', 'error')
         return redirect(url_for('admin.movie_episodes', movie_id=episode.movie_id))
     
-    # Headers required by the upstream server
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:146.0) Gecko/20100101 Firefox/146.0",
-        "Accept": "video/webm,video/ogg,video/*;q=0.9,application/ogg;q=0.7,audio/*;q=0.6,*/*;q=0.5",
-        "Accept-Language": "en-CA,en-US;q=0.7,en;q=0.3",
-        "Origin": "https://www.dracinlovers.com",
-        "Referer": "https://www.dracinlovers.com/",
-        "Sec-Fetch-Dest": "video",
-        "Sec-Fetch-Mode": "cors",
-        "Sec-Fetch-Site": "cross-site",
-        "Priority": "u=4",
-        "Te": "trailers"
-    }
+    # Determine filename
+    ext = 'mp4' # Default
+    if '.' in url.split('/')[-1]:
+        ext = url.split('/')[-1].split('.')[-1].split('?')[0]
+        
+    safe_title = secure_filename(f"{episode.movie.title} - EP{episode.episode_number}")
+    filename = f"{safe_title}.{ext}"
+    
+    # A finished local mirror is sent straight from disk
+    local = mirrored_source(episode)
+    if local:
+        path = mirrored_path(local)
+        offloaded = offload_file(path, download_name=filename)
+        if offloaded is not None:
+            return offloaded
+        return send_file(path, as_attachment=True, download_name=filename)
+    
+    # Let nginx stream the file itself when offload is configured
+    offloaded = offload_upstream(url, download_name=filename)
+    if offloaded is not None:
+        return offloaded
+    
+    # Hand long downloads to the async streaming proxy when it is deployed
+    prefix = current_app.config.get('ASYNC_PROXY_URL')
+    if prefix:
+        token = sign_download(current_app.config['SECRET_KEY'], url, filename)
+        return redirect(f"{prefix}/download?{urlencode({'token': token})}")
     
     try:
-        req = requests.get(url, headers=headers, stream=True, verify=False)
-        
-        # Determine filename
-        ext = 'mp4' # Default
-        if '.' in url.split('/')[-1]:
-            ext = url.split('/')[-1].split('.')[-1].split('?')[0]
-            
-        safe_title = secure_filename(f"{episode.movie.title} - EP{episode.episode_number}")
-        filename = f"{safe_title}.{ext}"
+        req = upstream.get(url)
 
-        # Exclude some headers
-        excluded_headers = ['content-encoding', 'content-length', 'transfer-encoding', 'connection']
-        resp_headers = [(name, value) for (name, value) in req.headers.items()
-                       if name.lower() not in excluded_headers]
+        resp_headers = forward_headers(req)
         
         # Add Content-Disposition to force download
         resp_headers.append(('Content-Disposition', f'attachment; filename="{filename}"'))
@@ -238,7 +339,7 @@ def download_episode(id):
         if 'Content-Length' in req.headers:
             resp_headers.append(('Content-Length', req.headers['Content-Length']))
             
-        return Response(stream_with_context(req.iter_content(chunk_size=1024*16)), 
+        return Response(stream_with_context(iter_response(req)), 
                        status=req.status_code, 
                        headers=resp_headers)
                        
@@ -246,6 +347,25 @@ def download_episode(id):
         flash(f"Error fetching URL: {str(e)}", 'error')
         return redirect(url_for('admin.movie_episodes', movie_id=episode.movie_id))
 
+@admin_bp.route('/upstream-stats')
+@login_required
+@admin_required
+def upstream_stats():
+    return jsonify(upstream.stats())
+
+@admin_bp.route('/cache-stats')
+@login_required
+@admin_required
+def cache_stats():
+    return jsonify({
+        'images': image_cache.stats(),
+        'video': video_cache.stats(),
+        'coalescing': singleflight.stats(),
+        'views': view_counter.stats(),
+        'users': user_cache.stats(),
+        'search': search_index.stats(),
+    })
+
 # --- Plans CRUD ---
 
 @admin_bp.route('/plans')
@@ -305,8 +425,7 @@ def delete_plan(id):
 @login_required
 @admin_required
 def users():
-    page = request.args.get('page', 1, type=int)
-    users = User.query.order_by(User.created_at.desc()).paginate(page=page, per_page=20)
+    users = keyset_paginate(User.query, User, per_page=current_app.config['ADMIN_PER_PAGE'], count_key='users')
     return render_template('admin/users.html', users=users)
 
 @admin_bp.route('/users/edit/<int:id>', methods=['GET', 'POST'])
@@ -319,6 +438,7 @@ def edit_user(id):
         # Optional: Allow editing other fields if needed, but priority is role
         
         db.session.commit()
+        user_cache.invalidate(user.id)
         flash('User updated successfully', 'success')
         return redirect(url_for('admin.users'))
     return render_template('admin/user_form.html', user=user)
@@ -327,15 +447,14 @@ def edit_user(id):
 @login_required
 @admin_required
 def transactions():
-    page = request.args.get('page', 1, type=int)
     status_filter = request.args.get('status', 'all')
     
-    query = Transaction.query
+    query = Transaction.query.options(selectinload(Transaction.user), selectinload(Transaction.plan))
     
     if status_filter != 'all':
         query = query.filter_by(status=status_filter)
         
-    transactions = query.order_by(Transaction.created_at.desc()).paginate(page=page, per_page=20)
+    transactions = keyset_paginate(query, Transaction, per_page=current_app.config['ADMIN_PER_PAGE'], count_key=f"transactions:{status_filter}")
     
     return render_template('admin/transactions.html', transactions=transactions, status_filter=status_filter)
 
@@ -363,6 +482,8 @@ def approve_transaction(id):
                     # Cap at a reasonable max date (e.g., year 9999)
                     user.subscription_end_date = datetime(9999, 12, 31, 23, 59, 59)
             
+        record_payment(transaction)
         db.session.commit()
+        user_cache.invalidate(transaction.user_id)
         flash('Transaction approved', 'success')
     return redirect(url_for('admin.transactions'))
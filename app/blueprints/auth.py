@@ -3,6 +3,8 @@ from flask_login import login_user, logout_user, login_required, current_user
 from authlib.integrations.flask_client import OAuth
 from authlib.integrations.base_client.errors import MismatchingStateError, OAuthError
 from app.models import User, db
+from app.services.user_cache import user_cache
+from app.services.stats import record_signup
 import os
 
 auth_bp = Blueprint('auth', __name__)
@@ -74,6 +76,7 @@ def authorize():
                 role='customer' # Default role
             )
             db.session.add(user)
+            record_signup(user)
             db.session.commit()
         
         login_user(user)
@@ -141,14 +144,20 @@ def telegram_auth():
                     role='customer'
                 )
                 db.session.add(user)
+                record_signup(user)
                 db.session.commit()
         else:
             # Update info if changed
+            changed = False
             if user.name != full_name:
                 user.name = full_name
+                changed = True
             if photo_url and user.profile_pic != photo_url:
                 user.profile_pic = photo_url
+                changed = True
             db.session.commit()
+            if changed:
+                user_cache.invalidate(user.id)
                 
         login_user(user, remember=True)
         
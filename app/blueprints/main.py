@@ -1,22 +1,67 @@
-from flask import Blueprint, render_template, request, abort, Response, stream_with_context, redirect, url_for, jsonify
+from flask import Blueprint, render_template, request, abort, Response, stream_with_context, redirect, url_for, jsonify, send_file, current_app
 from flask_login import login_required, current_user
 from app import db, cache
-from app.models import Movie, Episode, SubscriptionPlan, Favorite, SiteSettings, Transaction
-from sqlalchemy.orm import subqueryload
+from app.models import Movie, Episode, SubscriptionPlan, Favorite, Transaction
 from datetime import datetime, timedelta
+from urllib.parse import urlencode, urlsplit
+import mimetypes
 import requests
-import urllib3
 from flask import make_response
-
-# Suppress InsecureRequestWarning
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
+from app.services.upstream import upstream, iter_response, forward_headers
+from app.services.image_cache import image_cache, ImageCacheError, VARIANTS
+from app.services.video_cache import video_cache, parse_range, VideoCacheError, RangeNotSatisfiable
+from app.services.http_cache import apply_cache_policy, not_modified, remember_validators, stored_validators
+from app.services.offload import offload_file, offload_upstream
+from app.services.warmup import schedule_episode_warmup
+from app.services.subtitles import subtitles, SubtitleError
+from app.services.prober import dead_urls
+from app.services.faststart import faststart
+from app.services.mirror import mirrored_path, ranked_sources
+from app.services.view_counter import view_counter
+from app.services.search import search_index
+from app.services.episode_index import episode_index
+from app.pagination import keyset_paginate, forget_count
+from app.services.hls import is_playlist, rewrite_playlist, read_playlist, remember_segments, is_known_segment, prefetch_after, PLAYLIST_MIMETYPE
 
 main_bp = Blueprint('main', __name__)
 
-@main_bp.context_processor
-def inject_settings():
-    settings = SiteSettings.query.first()
-    return dict(site_settings=settings)
+@main_bp.app_template_global()
+def poster_url(url, variant='card', **kwargs):
+    """
+    Proxy URL for a poster resized to one of the image cache VARIANTS.
+    """
+    if not url:
+        return ''
+    return url_for('main.proxy', url=url, variant=variant, **kwargs)
+
+@main_bp.app_template_global()
+def media_url(url):
+    """
+    URL a video element should stream from: the async streaming proxy when
+    ASYNC_PROXY_URL is configured, else main.proxy.
+    """
+    if not url:
+        return ''
+    prefix = current_app.config.get('ASYNC_PROXY_URL')
+    # Playlists and faststart-fixed MP4s are rewritten and local mirrors are
+    # served from disk, which only main.proxy does
+    if prefix and not is_playlist(url) and not faststart.has_layout(url) and not mirrored_path(url):
+        return f"{prefix}/proxy?{urlencode({'url': url})}"
+    return url_for('main.proxy', url=url)
+
+@main_bp.app_template_global()
+def subtitle_src(episode):
+    """
+    URL of an episode's converted WebVTT track. The version parameter changes
+    with subtitle_url, so browsers may cache each version for long.
+    """
+    return url_for('main.subtitle', episode_id=episode.id, v=subtitles.version(episode))
+
+@main_bp.app_template_global()
+def is_hls_source(url):
+    return bool(url) and is_playlist(url)
 
 @main_bp.route('/robots.txt')
 def robots():
@@ -33,13 +78,12 @@ def sitemap():
 
 @main_bp.route('/')
 def index():
-    page = request.args.get('page', 1, type=int)
-    movies = Movie.query.order_by(Movie.created_at.desc()).paginate(page=page, per_page=12)
+    movies = keyset_paginate(Movie.query, Movie, per_page=12, count_key='movies')
     
-    # Get user favorites if logged in
-    user_favorites = []
+    # Favorite flags for the movies on this page only
+    user_favorites = set()
     if current_user.is_authenticated:
-        user_favorites = [fav.movie_id for fav in Favorite.query.filter_by(user_id=current_user.id).all()]
+        user_favorites = Favorite.movie_ids_for(current_user.id, [movie.id for movie in movies.items])
         
     return render_template('main/index.html', movies=movies, user_favorites=user_favorites)
 
@@ -49,8 +93,9 @@ def search():
     page = request.args.get('page', 1, type=int)
     
     if query:
-        # Optimasi N+1 dengan subqueryload
-        movies = Movie.query.options(subqueryload(Movie.episodes)).filter(Movie.title.ilike(f'%{query}%')).order_by(Movie.created_at.desc()).paginate(page=page, per_page=12)
+        # Ranked by the search index; cards only need the denormalized
+        # episode_count, not the episodes
+        movies = search_index.paginate(query, page=page, per_page=12)
     else:
         movies = None
         
@@ -65,14 +110,15 @@ def profile():
 @main_bp.route('/history')
 @login_required
 def history():
-    transactions = Transaction.query.filter_by(user_id=current_user.id).order_by(Transaction.created_at.desc()).all()
+    transactions = (Transaction.query.options(selectinload(Transaction.plan))
+                    .filter_by(user_id=current_user.id).order_by(Transaction.created_at.desc()).all())
     return render_template('main/history.html', transactions=transactions)
 
 @main_bp.route('/favorites')
 @login_required
 def favorites():
-    page = request.args.get('page', 1, type=int)
-    favorites = Favorite.query.filter_by(user_id=current_user.id).order_by(Favorite.created_at.desc()).paginate(page=page, per_page=12)
+    favorites = keyset_paginate(Favorite.query.filter_by(user_id=current_user.id), Favorite, per_page=12,
+                                count_key=f"favorites:{current_user.id}")
     
     # Get movies from favorites
     movie_ids = [fav.movie_id for fav in favorites.items]
@@ -92,11 +138,17 @@ def toggle_favorite(movie_id):
     if favorite:
         db.session.delete(favorite)
         db.session.commit()
+        forget_count(f"favorites:{current_user.id}")
         return jsonify({'status': 'removed'})
     else:
         new_favorite = Favorite(user_id=current_user.id, movie_id=movie_id)
         db.session.add(new_favorite)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # A concurrent request (double click) added it first
+            db.session.rollback()
+        forget_count(f"favorites:{current_user.id}")
         return jsonify({'status': 'added'})
 
 
@@ -104,14 +156,27 @@ def toggle_favorite(movie_id):
 def movie_detail(movie_id):
     movie = Movie.query.get_or_404(movie_id)
     
-    # Increment views
-    movie.views += 1
-    db.session.commit()
+    # Counted in memory and written in batches by the view counter
+    view_counter.record(movie.id)
     
-    user_favorites = []
+    user_favorites = set()
     if current_user.is_authenticated:
-        user_favorites = [fav.movie_id for fav in Favorite.query.filter_by(user_id=current_user.id).all()]
-    return render_template('main/detail.html', movie=movie, user_favorites=user_favorites, now=datetime.utcnow())
+        user_favorites = Favorite.movie_ids_for(current_user.id, [movie.id])
+    return render_template('main/detail.html', movie=movie, episodes=episode_index.get(movie.id),
+                           user_favorites=user_favorites, now=datetime.utcnow())
+
+def can_watch(episode):
+    """
+    Whether the current user may play an episode.
+    """
+    if episode.is_free:
+        return True
+    if current_user.is_authenticated:
+        if current_user.subscription_end_date and current_user.subscription_end_date > datetime.utcnow():
+            return True
+        elif current_user.role == 'admin':
+            return True
+    return False
 
 @main_bp.route('/watch/<int:episode_id>')
 def watch(episode_id):
@@ -119,21 +184,76 @@ def watch(episode_id):
     movie = episode.movie
     
     # Check access permission
-    can_watch = False
-    if episode.is_free:
-        can_watch = True
-    elif current_user.is_authenticated:
-        if current_user.subscription_end_date and current_user.subscription_end_date > datetime.utcnow():
-            can_watch = True
-        elif current_user.role == 'admin':
-            can_watch = True
-            
-    if not can_watch:
+    if not can_watch(episode):
         # If user not logged in, redirect to login (or show locked message)
         # If logged in but no sub, show upgrade message
         return render_template('main/watch_locked.html', movie=movie, episode=episode)
 
-    return render_template('main/watch.html', movie=movie, episode=episode)
+    prev_ep, next_ep = episode_index.get(movie.id).neighbours(episode.id)
+    
+    # Binge viewers click "next": get its first bytes into the proxy cache now.
+    # Its sources are resolved by the background job, not by this request
+    if next_ep and can_watch(next_ep):
+        schedule_episode_warmup(next_ep.id)
+
+    # Don't make the player fetch a subtitle the link prober found broken
+    show_subtitle = bool(episode.subtitle_url) and episode.subtitle_url.strip() not in dead_urls(episode)
+
+    return render_template('main/watch.html', movie=movie, episode=episode, prev_ep=prev_ep, next_ep=next_ep,
+                           show_subtitle=show_subtitle)
+
+@main_bp.route('/subtitle/<int:episode_id>.vtt')
+def subtitle(episode_id):
+    episode = Episode.query.get_or_404(episode_id)
+    if not episode.subtitle_url:
+        abort(404)
+    if not can_watch(episode):
+        abort(403)
+
+    try:
+        vtt_path, gzip_path, etag = subtitles.get(episode)
+    except (SubtitleError, requests.exceptions.RequestException) as e:
+        current_app.logger.warning("Subtitle for episode %s unavailable: %s", episode_id, e)
+        return "Subtitle unavailable", 502
+
+    # Both representations are stored; each gets its own strong ETag
+    if 'gzip' in request.accept_encodings:
+        response = send_file(gzip_path, mimetype='text/vtt', etag=f"{etag}-gz", conditional=True)
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = send_file(vtt_path, mimetype='text/vtt', etag=etag, conditional=True)
+    response.vary.add('Accept-Encoding')
+    return apply_cache_policy(response, 'text/vtt')
+
+@main_bp.route('/stream/<int:episode_id>')
+def stream(episode_id):
+    episode = Episode.query.get_or_404(episode_id)
+    if not can_watch(episode):
+        abort(403)
+
+    sources = ranked_sources(episode)
+    if not sources:
+        return "All sources are temporarily unavailable", 503
+
+    error = None
+    for url in sources:
+        try:
+            response = _proxy_media(url, failover=True)
+        except requests.exceptions.RequestException as e:
+            current_app.logger.warning(f"Source {url} of episode {episode_id} failed: {e}")
+            error = e
+            continue
+        # Dead mirrors answer 403/404/410 as often as 5xx; only 416 is the viewer's fault
+        if response.status_code >= 400 and response.status_code != 416:
+            current_app.logger.warning(f"Source {url} of episode {episode_id} returned HTTP {response.status_code}")
+            error = f"HTTP {response.status_code} from {urlsplit(url).netloc}"
+            response.close()
+            continue
+        if response.status_code in (200, 206, 304):
+            cache.set(f'mirror:{episode.id}', url, timeout=current_app.config['MIRROR_STICKY_SECONDS'])
+        return response
+
+    return f"Error fetching URL: {error}", 502
 
 @main_bp.route('/subscribe')
 @login_required
@@ -146,19 +266,96 @@ def proxy():
     if not url:
         return "URL is required", 400
     
-    # Headers required by the upstream server
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:146.0) Gecko/20100101 Firefox/146.0",
-        "Accept": "video/webm,video/ogg,video/*;q=0.9,application/ogg;q=0.7,audio/*;q=0.6,*/*;q=0.5",
-        "Accept-Language": "en-CA,en-US;q=0.7,en;q=0.3",
-        "Origin": "https://www.dracinlovers.com",
-        "Referer": "https://www.dracinlovers.com/",
-        "Sec-Fetch-Dest": "video",
-        "Sec-Fetch-Mode": "cors",
-        "Sec-Fetch-Site": "cross-site",
-        "Priority": "u=4",
-        "Te": "trailers"
-    }
+    # Resized posters are served straight from the on-disk image cache
+    variant = request.args.get('variant')
+    if variant in VARIANTS:
+        try:
+            path, mimetype = image_cache.get(url, variant, accept_webp='image/webp' in request.headers.get('Accept', ''))
+            offloaded = offload_file(path, mimetype)
+            if offloaded is not None:
+                offloaded.vary.add('Accept')
+                return offloaded
+            response = send_file(path, mimetype=mimetype, conditional=True,
+                                 max_age=current_app.config['IMAGE_CACHE_MAX_AGE'])
+            response.vary.add('Accept')
+            return apply_cache_policy(response, mimetype)
+        except (ImageCacheError, requests.exceptions.RequestException) as e:
+            current_app.logger.warning(f"Image cache miss for {url}: {e}")
+    
+    try:
+        return _proxy_media(url)
+    except requests.exceptions.RequestException as e:
+        return f"Error fetching URL: {str(e)}", 500
+
+def _proxy_media(url, failover=False):
+    """
+    Serve an upstream media URL: rewritten playlist, block cache or plain
+    pass-through. Connection errors are raised so callers can fail over.
+    With failover=True the URL is one of several sources: it is never
+    handed to nginx (whose answer we could not check) and a 4xx from
+    upstream counts against its host.
+    """
+    # HLS playlists are rewritten so segments come back through the proxy
+    if is_playlist(url):
+        return _playlist_response(upstream.get(url, fail_on_4xx=failover))
+    
+    # Episodes mirrored to local storage never touch the CDN
+    path = mirrored_path(url)
+    if path is not None:
+        mimetype = mimetypes.guess_type(path)[0] or 'video/mp4'
+        offloaded = offload_file(path, mimetype)
+        if offloaded is not None:
+            return offloaded
+        response = send_file(path, mimetype=mimetype, conditional=True)
+        return apply_cache_policy(response, mimetype)
+    
+    # MP4s with moov at the end are served as a virtual faststart file
+    layout = faststart.layout(url)
+    if layout is not None:
+        return _faststart_response(url, layout)
+    
+    # In offload mode nginx streams the upstream URL itself
+    offloaded = None if failover else offload_upstream(url)
+    if offloaded is not None:
+        return offloaded
+    
+    # Video byte ranges are answered from the block cache where possible
+    range_header = request.headers.get('Range')
+    byte_range = parse_range(range_header)
+    is_segment = request.args.get('hls') == 'seg' and is_known_segment(url)
+    if video_cache.handles(url, range_header, force=is_segment) and (byte_range or not range_header):
+        # Revalidation of a cached file never needs to go upstream
+        meta = video_cache.meta(url)
+        cached = not_modified(meta)
+        if cached is not None:
+            return cached
+        try:
+            meta, start, end, chunks = video_cache.open_range(url, byte_range)
+        except RangeNotSatisfiable as e:
+            return Response(status=416, headers={'Content-Range': f'bytes */{e.size}'})
+        except (VideoCacheError, requests.exceptions.RequestException) as e:
+            current_app.logger.warning(f"Video cache bypassed for {url}: {e}")
+        else:
+            resp_headers = [
+                ('Content-Type', meta['content_type']),
+                ('Content-Length', str(end - start + 1)),
+                ('Accept-Ranges', 'bytes'),
+            ]
+            status = 200
+            if byte_range:
+                status = 206
+                resp_headers.append(('Content-Range', f"bytes {start}-{end}/{meta['size']}"))
+            if is_segment:
+                prefetch_after(url)
+            response = Response(stream_with_context(chunks), status=status, headers=resp_headers)
+            return apply_cache_policy(response, meta['content_type'], meta)
+    
+    # Answer revalidation from remembered upstream validators
+    cached = not_modified(stored_validators(url))
+    if cached is not None:
+        return cached
+    
+    headers = {}
     
     # Forward Range header if present (important for video seeking)
     if 'Range' in request.headers:
@@ -167,27 +364,79 @@ def proxy():
         # Some servers require Range header for large media files
         headers['Range'] = 'bytes=0-'
     
-    try:
-        # Use stream=True to avoid loading large files into memory
-        # verify=False is used because some CDNs might have certificate issues when accessed this way, 
-        # though ideally it should be True. 
-        req = requests.get(url, headers=headers, stream=True, verify=False)
-        
-        # Exclude some headers that shouldn't be forwarded or might cause issues
-        excluded_headers = ['content-encoding', 'content-length', 'transfer-encoding', 'connection']
-        resp_headers = [(name, value) for (name, value) in req.headers.items()
-                       if name.lower() not in excluded_headers]
+    # Pooled keep-alive client; streams so large files never sit in memory
+    req = upstream.get(url, headers=headers, fail_on_4xx=failover)
+    if is_playlist(url, req.headers.get('Content-Type')):
+        return _playlist_response(req)
+    if req.status_code < 400:
+        remember_validators(url, req.headers)
+    
+    resp_headers = forward_headers(req)
+    
+    # Manually set Content-Length if available to allow progress bars
+    if 'Content-Length' in req.headers:
+        resp_headers.append(('Content-Length', req.headers['Content-Length']))
         
-        # Manually set Content-Length if available to allow progress bars
-        if 'Content-Length' in req.headers:
-            resp_headers.append(('Content-Length', req.headers['Content-Length']))
-            
-        # Add Accept-Ranges to support seeking
-        resp_headers.append(('Accept-Ranges', 'bytes'))
-
-        return Response(stream_with_context(req.iter_content(chunk_size=1024*16)), 
-                       status=req.status_code, 
-                       headers=resp_headers)
-                       
-    except requests.exceptions.RequestException as e:
-        return f"Error fetching URL: {str(e)}", 500
+    # Add Accept-Ranges to support seeking
+    resp_headers.append(('Accept-Ranges', 'bytes'))
+
+    response = Response(stream_with_context(iter_response(req)), 
+                   status=req.status_code, 
+                   headers=resp_headers)
+    if req.status_code < 400:
+        apply_cache_policy(response, req.headers.get('Content-Type'))
+    return response
+
+def _faststart_response(url, layout):
+    validators = {'etag': layout['etag'], 'content_type': layout['content_type']}
+    cached = not_modified(validators)
+    if cached is not None:
+        return cached
+
+    size = layout['size']
+    byte_range = parse_range(request.headers.get('Range'))
+    start, end = byte_range or (0, None)
+    if start < 0:
+        start = max(size + start, 0)
+    if end is None or end >= size:
+        end = size - 1
+    if start > end:
+        return Response(status=416, headers={'Content-Range': f'bytes */{size}'})
+
+    resp_headers = [
+        ('Content-Type', layout['content_type']),
+        ('Content-Length', str(end - start + 1)),
+    ]
+    status = 200
+    if byte_range:
+        status = 206
+        resp_headers.append(('Content-Range', f"bytes {start}-{end}/{size}"))
+    response = Response(stream_with_context(faststart.iter_bytes(url, layout, start, end)),
+                        status=status, headers=resp_headers)
+    return apply_cache_policy(response, layout['content_type'], validators)
+
+def _playlist_response(req):
+    # /proxy is public: read at most MAX_PLAYLIST_BYTES, however big the body is
+    body = read_playlist(req)
+    if body is None:
+        return "Playlist too large", 502
+    if req.status_code >= 400:
+        return Response(body, status=req.status_code)
+
+    def proxy_link(absolute_url, nested):
+        if nested:
+            return url_for('main.proxy', url=absolute_url)
+        return url_for('main.proxy', url=absolute_url, hls='seg')
+
+    # Resolve relative URIs against the final URL (after redirects)
+    text = body.decode('utf-8', errors='replace')
+    rewritten, segments = rewrite_playlist(text, req.url, proxy_link)
+    remember_segments(segments)
+
+    response = Response(rewritten, mimetype=PLAYLIST_MIMETYPE)
+    # VOD and master playlists are static; live playlists must be refetched
+    if '#EXT-X-ENDLIST' in text or not segments:
+        response.headers['Cache-Control'] = 'public, max-age=300'
+    else:
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
@@ -4,6 +4,7 @@ from app.models import db, Transaction, SubscriptionPlan
 import os
 from werkzeug.utils import secure_filename
 from app.services.trakteer import TrakteerService
+from app.services.stats import record_transaction
 
 payment_bp = Blueprint('payment', __name__)
 
@@ -34,6 +35,7 @@ def checkout(plan_id):
                  qris_content = trakteer.get_qris(transaction.id, int(plan.price), current_user.email)
                  
                  transaction.qris_content = qris_content
+                 record_transaction(transaction)
                  db.session.commit()
                  
                  return redirect(url_for('payment.pay', transaction_id=transaction.id))
@@ -65,6 +67,7 @@ def checkout(plan_id):
                     status='pending'
                 )
                 db.session.add(transaction)
+                record_transaction(transaction)
                 db.session.commit()
                 flash('Payment proof uploaded successfully! Please wait for admin approval.', 'success')
                 return redirect(url_for('main.profile'))
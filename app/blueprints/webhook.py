@@ -1,6 +1,8 @@
 from flask import Blueprint, request, jsonify, current_app
 from app.models import Transaction, db, User, SubscriptionPlan
 from app.services.trakteer import TrakteerService
+from app.services.user_cache import user_cache
+from app.services.stats import record_payment
 import json
 from datetime import datetime, timedelta
 from app import csrf
@@ -83,7 +85,9 @@ def trakteer_webhook():
                 else:
                     user.subscription_end_date = now + timedelta(days=plan.duration_days)
         
+        record_payment(transaction)
         db.session.commit()
+        user_cache.invalidate(transaction.user_id)
         return jsonify({'status': 'success', 'transaction_id': transaction_id}), 200
     
     return jsonify({'status': 'already_paid'}), 200
@@ -0,0 +1,227 @@
+import os
+import random
+import time
+
+import click
+from sqlalchemy import update, select, func, case
+from sqlalchemy.orm import selectinload
+
+from app.models import db, Movie, Episode, EpisodeMirror, User
+
+
+def register_commands(app):
+    """
+    Maintenance commands, run with `flask <command>` (e.g. from cron via
+    `docker compose exec web flask probe-links`).
+    """
+
+    @app.cli.command('probe-links')
+    @click.option('--movie-id', type=int, help='Only probe the episodes of one movie.')
+    @click.option('--workers', type=int, default=None, help='Concurrent probes (default LINK_PROBE_WORKERS).')
+    @click.option('--batch-size', type=int, default=200, show_default=True, help='Episodes stored per commit.')
+    def probe_links(movie_id, workers, batch_size):
+        """Check every episode video, mirror and subtitle URL."""
+        from app.services.prober import probe_episodes
+
+        query = Episode.query.options(selectinload(Episode.probes)).order_by(Episode.id)
+        if movie_id:
+            query = query.filter(Episode.movie_id == movie_id)
+
+        checked = broken = 0
+        last_id = 0
+        while True:
+            episodes = query.filter(Episode.id > last_id).limit(batch_size).all()
+            if not episodes:
+                break
+            batch_checked, batch_broken = probe_episodes(episodes, workers)
+            checked += batch_checked
+            broken += batch_broken
+            last_id = episodes[-1].id
+            click.echo(f"Probed {checked} links so far, {broken} broken")
+
+        click.echo(f"Done: {checked} links checked, {broken} broken")
+
+    @app.cli.command('faststart-scan')
+    @click.option('--movie-id', type=int, help='Only scan the episodes of one movie.')
+    @click.option('--all', 'scan_all', is_flag=True, help='Rescan episodes that were already scanned.')
+    @click.option('--rebuild', is_flag=True, help='Rebuild faststart headers that already exist.')
+    def faststart_scan(movie_id, scan_all, rebuild):
+        """Find MP4 episodes with moov at the end and build faststart headers."""
+        from app.services.faststart import scan_episode
+
+        query = Episode.query.order_by(Episode.id)
+        if movie_id:
+            query = query.filter(Episode.movie_id == movie_id)
+        if not scan_all:
+            query = query.filter(Episode.is_faststart.is_(None))
+
+        counts = {True: 0, False: 0, None: 0}
+        for episode in query.all():
+            scan_episode(episode, rebuild=rebuild)
+            counts[episode.is_faststart] += 1
+            db.session.commit()
+
+        click.echo(f"Done: {counts[True]} faststart, {counts[False]} fixed, {counts[None]} skipped or unreadable")
+
+    @app.cli.command('mirror-episodes')
+    @click.option('--movie-id', type=int, help='Mirror every episode of one movie.')
+    @click.option('--episode-id', type=int, help='Mirror a single episode.')
+    @click.option('--verify', is_flag=True, help='Recheck the SHA-256 of finished mirrors instead of downloading.')
+    def mirror_episodes(movie_id, episode_id, verify):
+        """Download episodes to local storage (resumes unfinished ones)."""
+        from app.services.mirror import mirror_episode, file_sha256
+
+        if not movie_id and not episode_id:
+            raise click.UsageError('Pass --movie-id or --episode-id')
+
+        query = Episode.query.order_by(Episode.episode_number)
+        if episode_id:
+            query = query.filter(Episode.id == episode_id)
+        if movie_id:
+            query = query.filter(Episode.movie_id == movie_id)
+        episode_ids = [episode.id for episode in query.all()]
+
+        if verify:
+            mirrors = EpisodeMirror.query.filter(EpisodeMirror.episode_id.in_(episode_ids),
+                                                 EpisodeMirror.status == 'complete').all()
+            for mirror in mirrors:
+                ok = mirror.path and os.path.exists(mirror.path) and file_sha256(mirror.path) == mirror.sha256
+                if not ok:
+                    mirror.status = 'failed'
+                    mirror.error = 'Checksum mismatch or file missing'
+                click.echo(f"Episode {mirror.episode_id}: {'ok' if ok else 'BROKEN'}")
+            db.session.commit()
+            return
+
+        for episode_id in episode_ids:
+            mirror_episode(episode_id)
+            mirror = EpisodeMirror.query.filter_by(episode_id=episode_id).first()
+            click.echo(f"Episode {episode_id}: {mirror.status if mirror else 'skipped'}"
+                       + (f" ({mirror.error})" if mirror and mirror.error else ''))
+
+    @app.cli.command('recount-episodes')
+    def recount_episodes():
+        """Rebuild the denormalized episode counters on every movie."""
+        def per_movie(expression):
+            return select(expression).where(Episode.movie_id == Movie.id).scalar_subquery()
+
+        updated = db.session.execute(update(Movie).values(
+            episode_count=per_movie(func.count(Episode.id)),
+            free_episode_count=per_movie(func.coalesce(func.sum(case((Episode.is_free == True, 1), else_=0)), 0)),
+            latest_episode_at=per_movie(func.max(Episode.created_at)),
+        )).rowcount
+        db.session.commit()
+        click.echo(f"Recounted episodes for {updated} movies")
+
+    @app.cli.command('rollup-stats')
+    @click.option('--backfill', is_flag=True, help='Rebuild every day from the users and transactions tables.')
+    def rollup_stats(backfill):
+        """Refresh today's active subscribers in the dashboard rollups."""
+        from app.services import stats
+
+        if backfill:
+            days = stats.backfill()
+            click.echo(f"Rebuilt dashboard stats for {days} days")
+            return
+        active = stats.refresh_active_subscribers()
+        db.session.commit()
+        click.echo(f"{active} active subscribers today")
+
+    @app.cli.command('bench-search')
+    @click.option('--queries', type=int, default=50, show_default=True, help='Number of sample queries.')
+    @click.option('--repeat', type=int, default=5, show_default=True, help='Runs per query.')
+    def bench_search(queries, repeat):
+        """Compare the search index with the old title ILIKE query."""
+        from app.services.search import search_index
+
+        titles = [title for title, in db.session.query(Movie.title).filter(Movie.title.isnot(None))]
+        words = [word for title in titles for word in title.split() if len(word) >= 4]
+        if not words:
+            raise click.ClickException('No movie titles to build queries from')
+
+        # Whole words, prefixes (typing in progress) and one-letter typos
+        rng = random.Random(0)
+        samples = []
+        for i in range(queries):
+            word = rng.choice(words)
+            if i % 3 == 1:
+                word = word[:max(3, len(word) // 2)]
+            elif i % 3 == 2:
+                j = rng.randrange(len(word) - 1)
+                word = word[:j] + word[j + 1] + word[j] + word[j + 2:]
+            samples.append(word)
+
+        def ilike(q):
+            query = Movie.query.filter(Movie.title.ilike(f'%{q}%')).order_by(Movie.created_at.desc())
+            return query.paginate(page=1, per_page=12).items
+
+        def indexed(q):
+            return search_index.paginate(q, page=1, per_page=12).items
+
+        started = time.perf_counter()
+        search_index.search('')  # builds the index
+        click.echo(f"Index built in {(time.perf_counter() - started) * 1000:.1f} ms: {search_index.stats()}")
+
+        for name, run in (('ilike', ilike), ('index', indexed)):
+            timings = []
+            found = 0
+            for q in samples:
+                for _ in range(repeat):
+                    started = time.perf_counter()
+                    results = run(q)
+                    timings.append((time.perf_counter() - started) * 1000)
+                found += bool(results)
+                db.session.rollback()
+            timings.sort()
+            click.echo(f"{name:>6}: mean {sum(timings) / len(timings):.2f} ms, "
+                       f"p95 {timings[int(len(timings) * 0.95) - 1]:.2f} ms, "
+                       f"{found}/{len(samples)} queries with results")
+
+    @app.cli.command('check-query-plans')
+    @click.option('--verbose', is_flag=True, help='Print the plan of every statement.')
+    @click.option('--max-queries', type=int, default=None, help='Statements allowed per page (default SQL_QUERY_BUDGET).')
+    def check_query_plans(verbose, max_queries):
+        """EXPLAIN every query the main and admin pages run; fail on full scans or pages over budget."""
+        from app.services.query_plans import page_statements, checked_statements, hot_pages, explain, plan_problems
+        from app.services.view_counter import view_counter
+
+        # Rendering pages must not leave traces: no warmup fetches, no views
+        app.config['WARMUP_ENABLED'] = False
+        admin = User.query.filter_by(role='admin').order_by(User.id).first()
+        if admin is None:
+            click.echo('No admin user: admin and member pages will redirect to login')
+        pages = hot_pages()
+
+        client = app.test_client()
+        if admin is not None:
+            with client.session_transaction() as session:
+                session['_user_id'] = str(admin.id)
+                session['_fresh'] = True
+
+        budget = max_queries if max_queries is not None else app.config['SQL_QUERY_BUDGET']
+        over_budget = 0
+        results = page_statements(client, pages)
+        view_counter.discard()
+        for url, (status, executed) in results.items():
+            if status >= 400:
+                click.echo(f"{url}: HTTP {status}")
+            if budget and len(executed) > budget:
+                click.echo(f"{url}: {len(executed)} statements, budget is {budget}")
+                over_budget += 1
+        statements = checked_statements(results)
+
+        failures = 0
+        with db.engine.connect() as connection:
+            for statement, (url, parameters) in statements.items():
+                plan = explain(connection, statement, parameters)
+                problems = plan_problems(statement, plan)
+                if problems or verbose:
+                    click.echo(f"\n[{url}] {' '.join(statement.split())}")
+                    for line in plan:
+                        click.echo(f"    {'!! ' if line in problems else ''}{line}")
+                failures += bool(problems)
+
+        click.echo(f"\nChecked {len(statements)} statements from {len(pages)} pages: {failures} with full scans, "
+                   f"{over_budget} pages over the query budget")
+        if failures or over_budget:
+            raise SystemExit(1)
@@ -6,6 +6,10 @@ db = SQLAlchemy()
 
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
+    __table_args__ = (
+        db.Index('idx_user_created', 'created_at', 'id'),
+        db.Index('idx_user_subscription_end', 'subscription_end_date'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(255), unique=True, nullable=False)
     name = db.Column(db.String(255))
@@ -18,15 +22,36 @@ class User(UserMixin, db.Model):
 
 class Movie(db.Model):
     __tablename__ = 'movies'
+    __table_args__ = (
+        db.Index('idx_movie_created', 'created_at', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(255))
     description = db.Column(db.Text)
     poster_url = db.Column(db.Text)
     views = db.Column(db.Integer, default=0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Denormalized from episodes so movie grids never have to load them
+    episode_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    free_episode_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    latest_episode_at = db.Column(db.DateTime, nullable=True)
     
     episodes = db.relationship('Episode', backref='movie', lazy=True)
 
+    def refresh_episode_stats(self):
+        """
+        Recompute episode_count, free_episode_count and latest_episode_at.
+        Call after adding, editing or deleting one of the movie's episodes.
+        """
+        count, free, latest = db.session.query(
+            db.func.count(Episode.id),
+            db.func.coalesce(db.func.sum(db.case((Episode.is_free == True, 1), else_=0)), 0),
+            db.func.max(Episode.created_at),
+        ).filter(Episode.movie_id == self.id).one()
+        self.episode_count = count
+        self.free_episode_count = free
+        self.latest_episode_at = latest
+
 class SiteSettings(db.Model):
     __tablename__ = 'site_settings'
     id = db.Column(db.Integer, primary_key=True)
@@ -41,15 +66,73 @@ class SiteSettings(db.Model):
 
 class Episode(db.Model):
     __tablename__ = 'episodes'
+    __table_args__ = (
+        db.Index('idx_episode_movie_number', 'movie_id', 'episode_number'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     movie_id = db.Column(db.Integer, db.ForeignKey('movies.id'), nullable=False)
     title = db.Column(db.String(255))
     episode_number = db.Column(db.Integer)
     video_url = db.Column(db.Text)
     subtitle_url = db.Column(db.Text)
+    mirror_urls = db.Column(db.Text) # Extra copies of video_url, one per line
+    is_faststart = db.Column(db.Boolean, nullable=True) # None until the MP4 has been scanned
     is_free = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    probes = db.relationship('LinkProbe', backref='episode', lazy=True,
+                             cascade='all, delete-orphan', passive_deletes=True)
+    mirror = db.relationship('EpisodeMirror', backref='episode', uselist=False,
+                             cascade='all, delete-orphan', passive_deletes=True)
+
+    @property
+    def sources(self):
+        """
+        video_url followed by its mirrors, without blanks or duplicates.
+        """
+        urls = [self.video_url] + (self.mirror_urls or '').splitlines()
+        seen = []
+        for url in urls:
+            url = (url or '').strip()
+            if url and url not in seen:
+                seen.append(url)
+        return seen
+
+class LinkProbe(db.Model):
+    __tablename__ = 'link_probes'
+    id = db.Column(db.Integer, primary_key=True)
+    episode_id = db.Column(db.Integer, db.ForeignKey('episodes.id', ondelete='CASCADE'), nullable=False, index=True)
+    kind = db.Column(db.Enum('video', 'mirror', 'subtitle'), nullable=False)
+    url = db.Column(db.Text, nullable=False)
+    ok = db.Column(db.Boolean, default=False)
+    status_code = db.Column(db.Integer, nullable=True)
+    content_length = db.Column(db.BigInteger, nullable=True)
+    content_type = db.Column(db.String(255), nullable=True)
+    latency_ms = db.Column(db.Integer, nullable=True)
+    error = db.Column(db.String(255), nullable=True)
+    checked_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class EpisodeMirror(db.Model):
+    __tablename__ = 'episode_mirrors'
+    id = db.Column(db.Integer, primary_key=True)
+    episode_id = db.Column(db.Integer, db.ForeignKey('episodes.id', ondelete='CASCADE'), nullable=False, unique=True)
+    source_url = db.Column(db.Text, nullable=False)
+    path = db.Column(db.String(512))
+    status = db.Column(db.Enum('pending', 'downloading', 'complete', 'failed'), default='pending')
+    size = db.Column(db.BigInteger, nullable=True)
+    bytes_done = db.Column(db.BigInteger, default=0)
+    sha256 = db.Column(db.String(64), nullable=True)
+    error = db.Column(db.String(255), nullable=True)
+    started_at = db.Column(db.DateTime, nullable=True)
+    completed_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    @property
+    def progress(self):
+        if not self.size:
+            return 0
+        return int(100 * (self.bytes_done or 0) / self.size)
+
 class SubscriptionPlan(db.Model):
     __tablename__ = 'subscription_plans'
     id = db.Column(db.Integer, primary_key=True)
@@ -62,6 +145,8 @@ class Transaction(db.Model):
     __tablename__ = 'transactions'
     __table_args__ = (
         db.Index('idx_transaction_user_created', 'user_id', 'created_at'),
+        db.Index('idx_transaction_status_created', 'status', 'created_at', 'id'),
+        db.Index('idx_transaction_created', 'created_at', 'id'),
     )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -73,10 +158,52 @@ class Transaction(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     user = db.relationship('User', backref='transactions', lazy=True)
+    # plan_id has no foreign key: deleted plans leave their transactions behind
+    plan = db.relationship('SubscriptionPlan', primaryjoin='foreign(Transaction.plan_id) == SubscriptionPlan.id',
+                           viewonly=True, lazy=True)
 
 class Favorite(db.Model):
     __tablename__ = 'favorites'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'movie_id', name='unique_fav'),
+        db.Index('idx_favorite_user_created', 'user_id', 'created_at', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     movie_id = db.Column(db.Integer, db.ForeignKey('movies.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    @staticmethod
+    def movie_ids_for(user_id, movie_ids):
+        """
+        The subset of `movie_ids` the user has favorited. Only those rows are
+        read, however many favorites the user has.
+        """
+        movie_ids = list(movie_ids)
+        if not movie_ids:
+            return set()
+        rows = db.session.query(Favorite.movie_id).filter(
+            Favorite.user_id == user_id, Favorite.movie_id.in_(movie_ids))
+        return {movie_id for movie_id, in rows}
+
+class DailyStat(db.Model):
+    """
+    Per-day rollup for the admin dashboard (UTC days), kept up to date by
+    the signup, checkout and payment code paths. `flask rollup-stats
+    --backfill` rebuilds it from the source tables.
+    """
+    __tablename__ = 'daily_stats'
+    day = db.Column(db.Date, primary_key=True)
+    signups = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    transactions = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    paid_transactions = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    revenue = db.Column(db.Numeric(14, 2), nullable=False, default=0, server_default='0')
+    # Users with a running subscription at the last refresh that day
+    active_subscribers = db.Column(db.Integer, nullable=True)
+
+class DailyPlanRevenue(db.Model):
+    __tablename__ = 'daily_plan_revenue'
+    day = db.Column(db.Date, primary_key=True)
+    plan_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    paid_transactions = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    revenue = db.Column(db.Numeric(14, 2), nullable=False, default=0, server_default='0')
@@ -0,0 +1,158 @@
+import base64
+import binascii
+import json
+import math
+from datetime import datetime
+
+from flask import current_app, request
+from sqlalchemy import or_
+
+from app import cache
+
+
+def encode_cursor(direction, page, row):
+    payload = [direction, page, row.created_at.isoformat() if row.created_at else None, row.id]
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """
+    (direction, page, created_at, id) from a cursor, or None if it is
+    missing or malformed (which shows the first page).
+    """
+    if not token:
+        return None
+    try:
+        direction, page, created_at, row_id = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        if direction not in ('next', 'prev') or not isinstance(row_id, int):
+            return None
+        return direction, int(page), datetime.fromisoformat(created_at) if created_at else None, row_id
+    except (ValueError, TypeError, binascii.Error):
+        return None
+
+
+def _older(query, model, created_at, row_id, limit):
+    """
+    Up to `limit` rows after the cursor in (created_at DESC, id DESC)
+    order. Each filter is a range on the ordering index, so the database
+    seeks instead of walking from the start. Rows without created_at sort
+    last (as NULLs do in DESC order on MySQL and SQLite) and are topped up
+    with a second query.
+    """
+    if created_at is None:
+        return (query.filter(model.created_at.is_(None), model.id < row_id)
+                .order_by(model.id.desc()).limit(limit).all())
+    rows = (query.filter(model.created_at <= created_at,
+                         or_(model.created_at < created_at, model.id < row_id))
+            .order_by(model.created_at.desc(), model.id.desc()).limit(limit).all())
+    if len(rows) < limit:
+        rows += (query.filter(model.created_at.is_(None))
+                 .order_by(model.id.desc()).limit(limit - len(rows)).all())
+    return rows
+
+
+def _newer(query, model, created_at, row_id, limit):
+    """
+    Up to `limit` rows before the cursor, nearest first.
+    """
+    if created_at is None:
+        rows = (query.filter(model.created_at.is_(None), model.id > row_id)
+                .order_by(model.id.asc()).limit(limit).all())
+        if len(rows) < limit:
+            # The oldest dated row comes right before the undated ones
+            rows += (query.filter(model.created_at.isnot(None))
+                     .order_by(model.created_at.asc(), model.id.asc()).limit(limit - len(rows)).all())
+        return rows
+    return (query.filter(model.created_at >= created_at,
+                         or_(model.created_at > created_at, model.id > row_id))
+            .order_by(model.created_at.asc(), model.id.asc()).limit(limit).all())
+
+
+def cached_count(key, query):
+    """
+    COUNT(*) of `query`, cached for PAGINATION_COUNT_TTL seconds. Totals
+    shown next to keyset pages are approximate by design.
+    """
+    cache_key = f"count:{key}"
+    total = cache.get(cache_key)
+    if total is None:
+        total = query.order_by(None).count()
+        cache.set(cache_key, total, timeout=current_app.config['PAGINATION_COUNT_TTL'])
+    return total
+
+
+def forget_count(key):
+    cache.delete(f"count:{key}")
+
+
+class KeysetPage:
+    """
+    One page of a keyset-paginated listing. Links to the neighbouring pages
+    carry opaque cursors (prev_args/next_args) instead of page numbers.
+    """
+
+    def __init__(self, items, page, per_page, total, prev_cursor, next_cursor):
+        self.items = items
+        self.page = page
+        self.per_page = per_page
+        self.total = total
+        self.prev_cursor = prev_cursor
+        self.next_cursor = next_cursor
+
+    @property
+    def pages(self):
+        if self.total is None:
+            return None
+        return max(1, math.ceil(self.total / self.per_page))
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def prev_args(self):
+        return {'cursor': self.prev_cursor}
+
+    @property
+    def next_args(self):
+        return {'cursor': self.next_cursor}
+
+    def __iter__(self):
+        return iter(self.items)
+
+
+def keyset_paginate(query, model, per_page, count_key=None, cursor=None):
+    """
+    One page of `query`, newest first by (created_at, id), seeking past the
+    cursor in the request's ?cursor= instead of using OFFSET. Every page
+    costs the same however deep it is. The total is only counted (and
+    cached) when a count_key is given.
+    """
+    position = decode_cursor(cursor if cursor is not None else request.args.get('cursor'))
+
+    if position is None:
+        page = 1
+        rows = query.order_by(model.created_at.desc(), model.id.desc()).limit(per_page + 1).all()
+        more_before, more_after = False, len(rows) > per_page
+        rows = rows[:per_page]
+    else:
+        direction, page, created_at, row_id = position
+        if direction == 'next':
+            rows = _older(query, model, created_at, row_id, per_page + 1)
+            more_before, more_after = True, len(rows) > per_page
+            rows = rows[:per_page]
+        else:
+            rows = _newer(query, model, created_at, row_id, per_page + 1)
+            more_before, more_after = len(rows) > per_page, True
+            rows = rows[:per_page][::-1]
+            if not more_before:
+                page = 1
+
+    prev_cursor = encode_cursor('prev', max(page - 1, 1), rows[0]) if rows and more_before else None
+    next_cursor = encode_cursor('next', page + 1, rows[-1]) if rows and more_after else None
+    total = cached_count(count_key, query) if count_key else None
+    return KeysetPage(rows, page, per_page, total, prev_cursor, next_cursor)
@@ -0,0 +1,85 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundPool:
+    """
+    Small bounded thread pool for fire-and-forget media jobs (prefetch,
+    warmup, mirroring). Sized by <NAME>_WORKERS and <NAME>_MAX_PENDING.
+
+    Jobs are deduplicated by key: while a job with the same key is queued or
+    running, further submissions are ignored. When the queue is full new jobs
+    are dropped rather than piling up behind slow upstreams. Every job runs
+    inside an application context.
+    """
+
+    def __init__(self, name='background', max_workers=4, max_pending=64):
+        self.app = None
+        self.name = name
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor = None
+        self._pid = None
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        prefix = self.name.upper()
+        self.max_workers = app.config.get(f'{prefix}_WORKERS', self.max_workers)
+        self.max_pending = app.config.get(f'{prefix}_MAX_PENDING', self.max_pending)
+        app.extensions[self.name] = self
+
+    @property
+    def executor(self):
+        # Threads don't survive a fork, so each gunicorn worker gets its own pool
+        if self._executor is None or self._pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                thread_name_prefix=f'{self.name}-job')
+            self._pid = os.getpid()
+            self._pending = set()
+        return self._executor
+
+    def submit_once(self, key, fn, *args, **kwargs):
+        """
+        Queue fn(*args, **kwargs) unless a job with the same key is pending.
+        Returns True if the job was queued.
+        """
+        with self._lock:
+            executor = self.executor
+            if key in self._pending or len(self._pending) >= self.max_pending:
+                return False
+            self._pending.add(key)
+
+        def run():
+            try:
+                with self.app.app_context():
+                    fn(*args, **kwargs)
+            except Exception:
+                logger.exception("Background job %s failed", key)
+            finally:
+                with self._lock:
+                    self._pending.discard(key)
+
+        executor.submit(run)
+        return True
+
+    def is_pending(self, key):
+        with self._lock:
+            return key in self._pending
+
+    def stats(self):
+        with self._lock:
+            return {'pending': len(self._pending), 'max_pending': self.max_pending,
+                    'workers': self.max_workers}
+
+
+background = BackgroundPool()
+
+# Long-running local mirror downloads get their own pool so they never hold
+# up prefetch and warmup jobs
+mirror_jobs = BackgroundPool('mirror', max_workers=1, max_pending=1000)
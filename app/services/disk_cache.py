@@ -0,0 +1,88 @@
+import os
+import threading
+import time
+
+
+class DiskCache:
+    """
+    Base for the on-disk media caches.
+
+    Handles atomic writes and least-recently-used eviction by total bytes.
+    Recency is tracked through the file atime, which is set explicitly on
+    every hit so mtime (and therefore send_file's ETag) stays stable.
+    """
+
+    def __init__(self, max_bytes):
+        self.root = None
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._approx_bytes = None
+
+    def write_file(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temp file first so concurrent readers never see half a file
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            if self._approx_bytes is None:
+                self._approx_bytes = self._scan_size()
+            else:
+                self._approx_bytes += len(data)
+            over_budget = self._approx_bytes > self.max_bytes
+        if over_budget:
+            self.evict(keep=path)
+
+    def touch(self, path):
+        try:
+            st = os.stat(path)
+            os.utime(path, (time.time(), st.st_mtime))
+        except OSError:
+            pass
+
+    def _entries(self):
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                yield path, st.st_size, st.st_atime
+
+    def _scan_size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self, keep=None):
+        """
+        Delete least-recently-used files until the cache is back under 90%
+        of its byte budget. `keep` protects a file that is still being built.
+        """
+        entries = sorted(self._entries(), key=lambda e: e[2])
+        total = sum(size for _, size, _ in entries)
+        target = int(self.max_bytes * 0.9)
+        for path, size, _ in entries:
+            if total <= target:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        with self._lock:
+            self._approx_bytes = total
+        return total
+
+    def stats(self):
+        entries = list(self._entries())
+        return {
+            'files': len(entries),
+            'bytes': sum(size for _, size, _ in entries),
+            'max_bytes': self.max_bytes,
+        }
@@ -0,0 +1,88 @@
+import threading
+from array import array
+from collections import OrderedDict, namedtuple
+
+from app.models import db, Episode
+from app.services.stamps import stamps
+
+STAMP = 'episodes'
+
+EpisodeRef = namedtuple('EpisodeRef', 'id episode_number is_free')
+
+
+class MovieEpisodes:
+    """
+    The episodes of one movie in playing order, kept as compact parallel
+    arrays instead of ORM objects.
+    """
+
+    def __init__(self, rows):
+        self.ids = array('i', (row[0] for row in rows))
+        self.numbers = array('i', (row[1] or 0 for row in rows))
+        self.free = bytes(bool(row[2]) for row in rows)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        return EpisodeRef(self.ids[index], self.numbers[index], bool(self.free[index]))
+
+    def __iter__(self):
+        return (self[index] for index in range(len(self.ids)))
+
+    def neighbours(self, episode_id):
+        """
+        (previous, next) EpisodeRefs around an episode; None at either end.
+        """
+        try:
+            index = self.ids.index(episode_id)
+        except ValueError:
+            return None, None
+        previous = self[index - 1] if index > 0 else None
+        following = self[index + 1] if index + 1 < len(self.ids) else None
+        return previous, following
+
+
+class EpisodeIndex:
+    """
+    Per-process cache of each movie's episode list, so watch pages find
+    their neighbours and detail pages list episodes without loading every
+    Episode row. Episode CRUD bumps the 'episodes' stamp, which makes every
+    worker rebuild a movie's list on next use.
+    """
+
+    def __init__(self):
+        self.max_movies = 2000
+        self._movies = OrderedDict()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.max_movies = app.config.get('EPISODE_INDEX_MAX_MOVIES', self.max_movies)
+        app.extensions['episode_index'] = self
+
+    def get(self, movie_id):
+        stamp = stamps.read(STAMP)
+        with self._lock:
+            entry = self._movies.get(movie_id)
+            if entry is not None and entry[0] == stamp:
+                self._movies.move_to_end(movie_id)
+                return entry[1]
+
+        rows = (db.session.query(Episode.id, Episode.episode_number, Episode.is_free)
+                .filter(Episode.movie_id == movie_id)
+                .order_by(Episode.episode_number, Episode.id).all())
+        episodes = MovieEpisodes(rows)
+        with self._lock:
+            self._movies[movie_id] = (stamp, episodes)
+            self._movies.move_to_end(movie_id)
+            while len(self._movies) > self.max_movies:
+                self._movies.popitem(last=False)
+        return episodes
+
+    def invalidate(self):
+        with self._lock:
+            self._movies.clear()
+        stamps.bump(STAMP)
+
+
+episode_index = EpisodeIndex()
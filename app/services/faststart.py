@@ -0,0 +1,207 @@
+import hashlib
+import json
+import os
+import struct
+
+import requests
+from flask import current_app
+
+from app.models import db, Episode
+from app.services.disk_cache import DiskCache
+from app.services.mp4 import top_level_boxes, find_box, shift_chunk_offsets
+from app.services.upstream import upstream, iter_response
+from app.services.video_cache import video_cache, CONTENT_RANGE_RE
+
+
+class FaststartError(Exception):
+    pass
+
+
+class FaststartCache(DiskCache):
+    """
+    Faststart headers for MP4 files whose moov box sits after mdat.
+
+    Rather than mirroring the whole file, only a new header is stored: the
+    boxes before mdat followed by the moov box with its chunk offsets
+    shifted. The proxy then serves a virtual faststart file made of that
+    header plus byte ranges of the original (mdat onwards, moov left out),
+    so the player gets its index from the first request.
+    """
+
+    def __init__(self):
+        super().__init__(max_bytes=2 * 1024 * 1024 * 1024)
+        self.max_header_bytes = 64 * 1024 * 1024
+
+    def init_app(self, app):
+        self.root = app.config.get('FASTSTART_DIR') or os.path.join(app.instance_path, 'cache', 'faststart')
+        self.max_bytes = app.config.get('FASTSTART_MAX_BYTES', self.max_bytes)
+        self.max_header_bytes = app.config.get('FASTSTART_MAX_HEADER_BYTES', self.max_header_bytes)
+        app.extensions['faststart'] = self
+
+    def _base_path(self, url):
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.root, key[:2], key)
+
+    def has_layout(self, url):
+        base = self._base_path(url)
+        return os.path.exists(f"{base}.json") and os.path.exists(f"{base}.head")
+
+    def layout(self, url):
+        """
+        The stored virtual-file layout for `url`, or None.
+        """
+        base = self._base_path(url)
+        try:
+            with open(f"{base}.json") as f:
+                layout = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not os.path.exists(f"{base}.head"):
+            return None
+        self.touch(f"{base}.head")
+        return layout
+
+    def _read(self, url, offset, length):
+        resp = upstream.get(url, headers={'Range': f'bytes={offset}-{offset + length - 1}'}, stream=False)
+        if resp.status_code != 206:
+            raise FaststartError(f"Upstream answered a range request with {resp.status_code}")
+        match = CONTENT_RANGE_RE.match(resp.headers.get('Content-Range', ''))
+        size = int(match.group(3)) if match and match.group(3) != '*' else None
+        return resp.content, size, resp.headers.get('Content-Type')
+
+    def inspect(self, url):
+        """
+        Walk the top-level boxes of a remote MP4 with small range requests.
+        Returns (boxes, size, content_type); boxes is empty for non-MP4 files.
+        """
+        head, size, content_type = self._read(url, 0, 16)
+        if size is None:
+            raise FaststartError("Upstream did not report a file size")
+
+        def read(offset, length):
+            if offset + length <= len(head):
+                return head[offset:offset + length]
+            return self._read(url, offset, min(length, size - offset))[0]
+
+        return top_level_boxes(read, size), size, content_type
+
+    def build(self, url):
+        """
+        Inspect `url` and, if its moov box comes after mdat, store a
+        faststart header for it. Returns True if the file already was
+        faststart, False if a header was built, None if it is not an MP4.
+        """
+        boxes, size, content_type = self.inspect(url)
+        moov = find_box(boxes, b'moov')
+        mdat = find_box(boxes, b'mdat')
+        if moov is None or mdat is None or find_box(boxes, b'moof') is not None:
+            # Not a progressive MP4 (or the walk stopped early)
+            self._discard(url)
+            return None
+        if moov.offset < mdat.offset:
+            self._discard(url)
+            return True
+
+        prefix_size = mdat.offset
+        if prefix_size + moov.size > self.max_header_bytes:
+            raise FaststartError("moov box too large to relocate")
+
+        prefix = self._read(url, 0, prefix_size)[0] if prefix_size else b''
+        moov_bytes = self._read(url, moov.offset, moov.size)[0]
+        if len(prefix) != prefix_size or len(moov_bytes) != moov.size:
+            raise FaststartError("Short read from upstream")
+
+        # Everything between mdat and moov moves down by the size of moov
+        try:
+            moov_bytes = shift_chunk_offsets(moov_bytes, mdat.offset, moov.offset, moov.size)
+        except (ValueError, struct.error) as e:
+            raise FaststartError(f"Cannot patch chunk offsets: {e}")
+
+        header = prefix + moov_bytes
+        layout = {
+            'size': size,
+            'content_type': content_type or 'video/mp4',
+            'header_size': len(header),
+            'etag': '"fs-%s"' % hashlib.sha256(header).hexdigest()[:32],
+            # (virtual offset, original offset, length) of the remote parts
+            'segments': [[len(header), mdat.offset, moov.offset - mdat.offset],
+                         [len(header) + moov.offset - mdat.offset, moov.end, size - moov.end]],
+        }
+        base = self._base_path(url)
+        self.write_file(f"{base}.head", header)
+        self.write_file(f"{base}.json", json.dumps(layout).encode('utf-8'))
+        return False
+
+    def _discard(self, url):
+        base = self._base_path(url)
+        for path in (f"{base}.json", f"{base}.head"):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def iter_bytes(self, url, layout, start, end):
+        """
+        Yield bytes start..end (inclusive) of the virtual faststart file.
+        """
+        header_size = layout['header_size']
+        if start < header_size:
+            with open(f"{self._base_path(url)}.head", 'rb') as f:
+                f.seek(start)
+                yield f.read(min(end, header_size - 1) - start + 1)
+
+        for virtual_start, original_start, length in layout['segments']:
+            first = max(start, virtual_start)
+            last = min(end, virtual_start + length - 1)
+            if length <= 0 or first > last:
+                continue
+            original_first = original_start + first - virtual_start
+            original_last = original_start + last - virtual_start
+            yield from self._iter_original(url, original_first, original_last)
+
+    def _iter_original(self, url, first, last):
+        if video_cache.enabled:
+            _, _, _, chunks = video_cache.open_range(url, (first, last))
+            yield from chunks
+            return
+        resp = upstream.get(url, headers={'Range': f'bytes={first}-{last}'})
+        if resp.status_code != 206:
+            resp.close()
+            raise FaststartError(f"Upstream answered a range request with {resp.status_code}")
+        yield from iter_response(resp)
+
+
+def scan_episode(episode, rebuild=False):
+    """
+    Record whether an episode's video is faststart and build faststart
+    headers for every source that is not. Errors are logged, not raised.
+    """
+    # hls needs the app's cache, which does not exist yet when this module loads
+    from app.services.hls import is_playlist
+
+    if not episode.video_url or is_playlist(episode.video_url):
+        episode.is_faststart = None
+        return
+
+    for url in episode.sources:
+        if faststart.has_layout(url) and not rebuild:
+            result = False
+        else:
+            try:
+                result = faststart.build(url)
+            except (FaststartError, requests.exceptions.RequestException) as e:
+                current_app.logger.warning(f"Faststart scan of {url} failed: {e}")
+                continue
+        if url == episode.video_url.strip():
+            episode.is_faststart = result
+
+
+def scan_episode_id(episode_id):
+    episode = Episode.query.get(episode_id)
+    if episode is None:
+        return
+    scan_episode(episode)
+    db.session.commit()
+
+
+faststart = FaststartCache()
@@ -0,0 +1,172 @@
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+
+# Priors for hosts we have not measured yet, so a fresh mirror neither wins
+# nor loses every ranking by default
+DEFAULT_TTFB = 0.5
+DEFAULT_THROUGHPUT = 2 * 1024 * 1024
+
+# Bodies smaller than this say more about latency than bandwidth
+MIN_THROUGHPUT_SAMPLE = 256 * 1024
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitOpen(requests.exceptions.ConnectionError):
+    """
+    Raised instead of contacting a host whose circuit breaker is open.
+    """
+
+
+class HostState:
+    def __init__(self):
+        self.ttfb = None
+        self.throughput = None
+        self.failures = 0
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.requests = 0
+        self.errors = 0
+
+
+class HostHealth:
+    """
+    Rolling per-host view of upstream health for this worker process.
+
+    TTFB and throughput are tracked as exponentially weighted averages. After
+    UPSTREAM_CIRCUIT_FAILURES consecutive failures a host's circuit opens and
+    requests to it fail immediately for UPSTREAM_CIRCUIT_COOLDOWN seconds;
+    then a single trial request is let through to decide whether it closes.
+    """
+
+    def __init__(self):
+        self.alpha = 0.3
+        self.max_failures = 5
+        self.cooldown = 30
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.alpha = app.config.get('UPSTREAM_HEALTH_ALPHA', self.alpha)
+        self.max_failures = app.config.get('UPSTREAM_CIRCUIT_FAILURES', self.max_failures)
+        self.cooldown = app.config.get('UPSTREAM_CIRCUIT_COOLDOWN', self.cooldown)
+        app.extensions['upstream_health'] = self
+
+    def _state(self, host):
+        state = self._hosts.get(host)
+        if state is None:
+            state = self._hosts[host] = HostState()
+        return state
+
+    def _average(self, current, sample):
+        if current is None:
+            return sample
+        return current + self.alpha * (sample - current)
+
+    def allow(self, host):
+        """
+        Whether a request to host may go ahead. Moves an open circuit whose
+        cooldown has passed to half-open and lets exactly one trial through.
+        """
+        with self._lock:
+            state = self._state(host)
+            if state.state == CLOSED:
+                return True
+            if time.monotonic() - state.opened_at < self.cooldown:
+                return False
+            # Open, or half-open with a trial that never reported back within
+            # a cooldown: let one new trial through
+            state.state = HALF_OPEN
+            state.opened_at = time.monotonic()
+            return True
+
+    def is_available(self, host):
+        """
+        Like allow() but without claiming the half-open trial.
+        """
+        with self._lock:
+            state = self._hosts.get(host)
+            if state is None or state.state == CLOSED:
+                return True
+            return time.monotonic() - state.opened_at >= self.cooldown
+
+    def record_success(self, host, ttfb):
+        with self._lock:
+            state = self._state(host)
+            state.requests += 1
+            state.ttfb = self._average(state.ttfb, ttfb)
+            state.failures = 0
+            state.state = CLOSED
+
+    def record_failure(self, host):
+        with self._lock:
+            state = self._state(host)
+            state.requests += 1
+            state.errors += 1
+            state.failures += 1
+            if state.state == HALF_OPEN or state.failures >= self.max_failures:
+                state.state = OPEN
+                state.opened_at = time.monotonic()
+
+    def record_transfer(self, host, nbytes, seconds):
+        if nbytes < MIN_THROUGHPUT_SAMPLE or seconds <= 0:
+            return
+        with self._lock:
+            state = self._state(host)
+            state.throughput = self._average(state.throughput, nbytes / seconds)
+
+    def metered(self, resp, chunks):
+        """
+        Pass a response body through while measuring throughput; a read that
+        fails mid-body counts against the host.
+        """
+        host = getattr(resp, 'upstream_host', None) or urlsplit(resp.url).netloc
+        started = time.monotonic()
+        total = 0
+        try:
+            for chunk in chunks:
+                total += len(chunk)
+                yield chunk
+        except requests.exceptions.RequestException:
+            self.record_failure(host)
+            raise
+        finally:
+            self.record_transfer(host, total, time.monotonic() - started)
+
+    def score(self, host):
+        """
+        Expected seconds to start and fetch the first megabyte; lower is better.
+        """
+        with self._lock:
+            state = self._hosts.get(host)
+            ttfb = state.ttfb if state and state.ttfb is not None else DEFAULT_TTFB
+            throughput = state.throughput if state and state.throughput else DEFAULT_THROUGHPUT
+        return ttfb + (1024 * 1024) / throughput
+
+    def rank(self, urls):
+        """
+        Order candidate URLs from healthiest/fastest to slowest, dropping
+        those whose host is currently cut off by its circuit breaker.
+        """
+        candidates = [url for url in urls if self.is_available(urlsplit(url).netloc)]
+        # sorted() is stable, so ties keep the admin's order (primary first)
+        return sorted(candidates, key=lambda url: self.score(urlsplit(url).netloc))
+
+    def stats(self):
+        with self._lock:
+            return {host: {
+                'state': state.state,
+                'ttfb_ms': round(state.ttfb * 1000, 1) if state.ttfb is not None else None,
+                'throughput_kbps': round(state.throughput / 1024, 1) if state.throughput else None,
+                'consecutive_failures': state.failures,
+                'requests': state.requests,
+                'errors': state.errors,
+            } for host, state in self._hosts.items()}
+
+
+health = HostHealth()
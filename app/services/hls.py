@@ -0,0 +1,116 @@
+import hashlib
+import re
+from urllib.parse import urljoin
+
+from flask import current_app
+
+from app import cache
+from app.services.background import background
+from app.services.video_cache import video_cache
+
+PLAYLIST_TYPES = (
+    'application/vnd.apple.mpegurl',
+    'application/x-mpegurl',
+    'audio/mpegurl',
+    'audio/x-mpegurl',
+)
+PLAYLIST_MIMETYPE = 'application/vnd.apple.mpegurl'
+
+# Largest playlist we are willing to buffer and rewrite
+MAX_PLAYLIST_BYTES = 2 * 1024 * 1024
+
+URI_ATTR_RE = re.compile(r'URI="([^"]+)"')
+
+# How long a segment -> next segments mapping is remembered
+NEIGHBOURS_TIMEOUT = 6 * 3600
+
+
+def is_playlist(url, content_type=None):
+    if content_type and content_type.split(';')[0].strip().lower() in PLAYLIST_TYPES:
+        return True
+    return url.split('?', 1)[0].lower().endswith('.m3u8')
+
+
+def rewrite_playlist(text, base_url, proxy_url):
+    """
+    Rewrite every URI in an m3u8 playlist so it goes back through the proxy.
+
+    `proxy_url(absolute_url, is_playlist)` builds the replacement. Returns the
+    new playlist text and the ordered list of media segment URLs (empty for
+    master playlists).
+    """
+    lines = []
+    segments = []
+    for line in text.splitlines():
+        stripped = line.strip()
+        if not stripped:
+            lines.append(line)
+        elif stripped.startswith('#'):
+            # EXT-X-KEY, EXT-X-MAP, EXT-X-MEDIA, EXT-X-I-FRAME-STREAM-INF
+            lines.append(URI_ATTR_RE.sub(
+                lambda m: 'URI="%s"' % proxy_url(urljoin(base_url, m.group(1)), is_playlist(m.group(1))),
+                line))
+        else:
+            absolute = urljoin(base_url, stripped)
+            nested = is_playlist(absolute)
+            if not nested:
+                segments.append(absolute)
+            lines.append(proxy_url(absolute, nested))
+    return '\n'.join(lines) + '\n', segments
+
+
+def _neighbours_key(url):
+    return 'hls:next:' + hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+
+def read_playlist(resp):
+    """
+    The body of a streamed upstream response, or None once it grows past
+    MAX_PLAYLIST_BYTES. Never buffers more than that.
+    """
+    body = bytearray()
+    try:
+        for chunk in resp.iter_content(64 * 1024):
+            body += chunk
+            if len(body) > MAX_PLAYLIST_BYTES:
+                return None
+    finally:
+        resp.close()
+    return bytes(body)
+
+
+def remember_segments(segments):
+    """
+    Record the segments of a rewritten playlist, each with the segments that
+    follow it so a request for one can trigger prefetch of the next ones.
+    """
+    if not segments:
+        return
+    count = current_app.config.get('HLS_PREFETCH_SEGMENTS', 3)
+    cache.set_many({_neighbours_key(url): segments[i + 1:i + 1 + count] if count else []
+                    for i, url in enumerate(segments)}, timeout=NEIGHBOURS_TIMEOUT)
+
+
+def is_known_segment(url):
+    """
+    Whether `url` came out of a playlist this worker rewrote. Only those are
+    forced into the block cache; ?hls=seg on any other URL is ignored.
+    """
+    return cache.get(_neighbours_key(url)) is not None
+
+
+def prefetch_after(url):
+    """
+    Warm the block cache with the segments that follow `url`, in the
+    background. Returns the number of prefetch jobs queued.
+    """
+    upcoming = cache.get(_neighbours_key(url))
+    if not upcoming:
+        return 0
+    queued = 0
+    for segment_url in upcoming:
+        if video_cache.meta(segment_url) is not None:
+            continue
+        if background.submit_once(f'hls-prefetch:{segment_url}', video_cache.warm, segment_url):
+            queued += 1
+    return queued
@@ -0,0 +1,90 @@
+import hashlib
+
+from flask import request, Response
+from werkzeug.http import is_resource_modified, parse_date, unquote_etag
+
+from app import cache
+
+# Cache-Control per content type prefix; first match wins
+CACHE_POLICIES = [
+    # Posters never change for a given upstream URL
+    ('image/', 'public, max-age=2592000, immutable'),
+    ('text/vtt', 'public, max-age=604800'),
+    ('application/x-subrip', 'public, max-age=604800'),
+    # Video is fetched by range; let shared caches keep the partial responses
+    ('video/', 'public, max-age=86400'),
+    ('audio/', 'public, max-age=86400'),
+]
+DEFAULT_POLICY = 'public, max-age=3600'
+
+# How long upstream validators are remembered per worker
+VALIDATOR_TIMEOUT = 24 * 3600
+
+
+def cache_control_for(content_type):
+    content_type = (content_type or '').lower()
+    for prefix, policy in CACHE_POLICIES:
+        if content_type.startswith(prefix):
+            return policy
+    return DEFAULT_POLICY
+
+
+def apply_cache_policy(response, content_type=None, validators=None):
+    """
+    Set Cache-Control (and upstream validators, when known) on a response.
+    """
+    content_type = content_type or response.headers.get('Content-Type')
+    response.headers['Cache-Control'] = cache_control_for(content_type)
+    if content_type and content_type.lower().startswith(('video/', 'audio/')):
+        response.headers['Accept-Ranges'] = 'bytes'
+    if validators:
+        if validators.get('etag') and 'ETag' not in response.headers:
+            response.headers['ETag'] = validators['etag']
+        if validators.get('last_modified') and 'Last-Modified' not in response.headers:
+            response.headers['Last-Modified'] = validators['last_modified']
+    return response
+
+
+def _key(url):
+    return 'validators:' + hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+
+def remember_validators(url, headers):
+    """
+    Keep the upstream ETag / Last-Modified of a URL so later revalidations can
+    be answered without going upstream.
+    """
+    validators = {
+        'etag': headers.get('ETag'),
+        'last_modified': headers.get('Last-Modified'),
+        'content_type': headers.get('Content-Type'),
+    }
+    if validators['etag'] or validators['last_modified']:
+        cache.set(_key(url), validators, timeout=VALIDATOR_TIMEOUT)
+    return validators
+
+
+def stored_validators(url):
+    return cache.get(_key(url))
+
+
+def not_modified(validators):
+    """
+    304 response if the request's If-None-Match / If-Modified-Since still
+    match the known validators, else None.
+    """
+    if not validators:
+        return None
+    if 'If-None-Match' not in request.headers and 'If-Modified-Since' not in request.headers:
+        return None
+
+    etag = unquote_etag(validators['etag'])[0] if validators.get('etag') else None
+    last_modified = parse_date(validators['last_modified']) if validators.get('last_modified') else None
+    if etag is None and last_modified is None:
+        return None
+
+    if is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        return None
+
+    response = Response(status=304)
+    return apply_cache_policy(response, validators.get('content_type'), validators)
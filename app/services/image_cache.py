@@ -0,0 +1,121 @@
+import hashlib
+import os
+from io import BytesIO
+
+from app.services.disk_cache import DiskCache
+from app.services.singleflight import singleflight
+from app.services.upstream import upstream
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow missing: originals are cached but never resized
+    Image = None
+
+# Named size variants templates can ask for: (max width, max height, forced format)
+VARIANTS = {
+    'card': (360, 540, None),
+    'hero': (960, 1440, None),
+    # Crawlers (Facebook, Telegram, WhatsApp) don't reliably support WebP
+    'og': (1200, 1200, 'jpeg'),
+}
+
+MIMETYPES = {
+    'webp': 'image/webp',
+    'jpeg': 'image/jpeg',
+}
+
+
+class ImageCacheError(Exception):
+    pass
+
+
+class ImageCache(DiskCache):
+    """
+    On-disk poster cache.
+
+    Each upstream image is downloaded once, then resized into the named
+    VARIANTS on demand. Files live under IMAGE_CACHE_DIR and are evicted
+    least-recently-used first once the directory grows past
+    IMAGE_CACHE_MAX_BYTES.
+    """
+
+    def __init__(self):
+        super().__init__(max_bytes=512 * 1024 * 1024)
+        self.max_source_bytes = 10 * 1024 * 1024
+        self.quality = 80
+
+    def init_app(self, app):
+        self.root = app.config.get('IMAGE_CACHE_DIR') or os.path.join(app.instance_path, 'cache', 'images')
+        self.max_bytes = app.config.get('IMAGE_CACHE_MAX_BYTES', self.max_bytes)
+        self.max_source_bytes = app.config.get('IMAGE_CACHE_MAX_SOURCE_BYTES', self.max_source_bytes)
+        self.quality = app.config.get('IMAGE_CACHE_QUALITY', self.quality)
+        app.extensions['image_cache'] = self
+
+    def _base_path(self, url):
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.root, key[:2], key)
+
+    def get(self, url, variant, accept_webp=True):
+        """
+        Return (path, mimetype) of a cached variant, building it if needed.
+        """
+        if variant not in VARIANTS:
+            raise ImageCacheError(f"Unknown image variant: {variant}")
+
+        width, height, forced_format = VARIANTS[variant]
+        fmt = forced_format or ('webp' if accept_webp else 'jpeg')
+        if Image is None:
+            fmt = 'orig'
+
+        base = self._base_path(url)
+        path = f"{base}.{variant}.{fmt}" if fmt != 'orig' else f"{base}.orig"
+        if os.path.exists(path):
+            self.touch(path)
+            return path, MIMETYPES.get(fmt)
+
+        original = self._original(url, base)
+        if fmt != 'orig':
+            self._render(original, path, width, height, fmt)
+        return path, MIMETYPES.get(fmt)
+
+    def _original(self, url, base):
+        path = f"{base}.orig"
+        if os.path.exists(path):
+            self.touch(path)
+            return path
+
+        # A burst of requests for a new poster shares one upstream fetch
+        singleflight.run(f"image:{url}", lambda: self._download(url, path),
+                         ready=lambda: os.path.exists(path))
+        return path
+
+    def _download(self, url, path):
+        resp = upstream.get(url)
+        try:
+            if resp.status_code >= 400:
+                raise ImageCacheError(f"Upstream returned {resp.status_code}")
+            data = BytesIO()
+            for chunk in resp.iter_content(chunk_size=1024*64):
+                data.write(chunk)
+                if data.tell() > self.max_source_bytes:
+                    raise ImageCacheError("Source image too large to cache")
+        finally:
+            resp.close()
+
+        self.write_file(path, data.getvalue())
+
+    def _render(self, original, path, width, height, fmt):
+        try:
+            with Image.open(original) as img:
+                img = ImageOps.exif_transpose(img)
+                img.thumbnail((width, height), Image.LANCZOS)
+                if img.mode not in ('RGB', 'RGBA') or (fmt == 'jpeg' and img.mode == 'RGBA'):
+                    img = img.convert('RGB')
+                out = BytesIO()
+                img.save(out, format=fmt.upper(), quality=self.quality, optimize=True)
+        except (OSError, ValueError) as e:
+            raise ImageCacheError(f"Cannot decode image: {e}")
+        self.write_file(path, out.getvalue())
+
+
+image_cache = ImageCache()
@@ -0,0 +1,274 @@
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+
+import requests
+from flask import current_app
+from sqlalchemy import or_
+
+from app import cache
+from app.models import db, Episode, EpisodeMirror
+from app.services.health import health
+from app.services.prober import probe_url, dead_urls
+from app.services.upstream import upstream
+
+# A 'downloading' row not updated for this long belongs to a dead job
+STALE_AFTER = timedelta(minutes=5)
+
+
+class MirrorError(Exception):
+    pass
+
+
+def _extension(url):
+    name = url.split('?', 1)[0].rsplit('/', 1)[-1]
+    ext = name.rsplit('.', 1)[-1].lower() if '.' in name else ''
+    return ext if ext.isalnum() and len(ext) <= 5 else 'mp4'
+
+
+def local_path(url):
+    """
+    Where the local copy of an upstream URL lives. The file only appears
+    there once the download is complete and checksummed.
+    """
+    key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+    root = current_app.config.get('MIRROR_DIR') or os.path.join(current_app.instance_path, 'media')
+    return os.path.join(root, key[:2], f"{key}.{_extension(url)}")
+
+
+def mirrored_path(url):
+    path = local_path(url)
+    return path if os.path.exists(path) else None
+
+
+def _still_used(url):
+    # Substring match errs on the side of keeping a file
+    query = Episode.query.filter(or_(Episode.video_url.contains(url, autoescape=True),
+                                     Episode.mirror_urls.contains(url, autoescape=True)))
+    return db.session.query(query.exists()).scalar()
+
+
+def remove_local_copies(urls):
+    """
+    Delete the local copy and any partial download of each URL that no
+    episode uses any more. Mirrored files are not part of any cache, so
+    nothing else removes them. Call after committing the change that
+    dropped the URLs. Returns the number of files removed.
+    """
+    removed = 0
+    for url in set(urls):
+        if _still_used(url):
+            continue
+        path = local_path(url)
+        part_path = f"{path}.part"
+        for name in (path, part_path, f"{part_path}.json", f"{part_path}.json.tmp"):
+            try:
+                os.remove(name)
+                removed += 1
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                current_app.logger.warning(f"Could not remove mirrored file {name}: {e}")
+    return removed
+
+
+def mirrored_source(episode):
+    """
+    The first source of an episode that has a complete local copy, or None.
+    """
+    for url in episode.sources:
+        if mirrored_path(url):
+            return url
+    return None
+
+
+def ranked_sources(episode):
+    """
+    The episode's healthy sources, best first. The last source that served
+    the episode stays in front while healthy, so one viewer's range requests
+    keep hitting the same mirror (and the same block cache entries). Sources
+    the link prober found dead are skipped unless nothing else is left.
+    """
+    local = mirrored_source(episode)
+    if local:
+        # Served from our own disk: no upstream involved at all
+        return [local]
+    dead = dead_urls(episode)
+    sources = health.rank([url for url in episode.sources if url not in dead]) or health.rank(episode.sources)
+    preferred = cache.get(f'mirror:{episode.id}')
+    if preferred in sources:
+        sources.remove(preferred)
+        sources.insert(0, preferred)
+    return sources
+
+
+class _Progress:
+    """
+    Pieces already on disk, persisted next to the partial file so a failed
+    or interrupted download resumes where it stopped.
+    """
+
+    def __init__(self, path, url, size):
+        self.path = path
+        self.url = url
+        self.size = size
+        self.done = set()
+        self._lock = threading.Lock()
+        try:
+            with open(path) as f:
+                saved = json.load(f)
+            if saved.get('url') == url and saved.get('size') == size:
+                self.done = set(saved['done'])
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def add(self, index):
+        with self._lock:
+            self.done.add(index)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump({'url': self.url, 'size': self.size, 'done': sorted(self.done)}, f)
+            os.replace(tmp_path, self.path)
+
+
+def _download_piece(url, fd, start, end):
+    resp = upstream.get(url, headers={'Range': f'bytes={start}-{end}'})
+    try:
+        if resp.status_code != 206:
+            raise MirrorError(f"Upstream answered a range request with {resp.status_code}")
+        offset = start
+        for chunk in health.metered(resp, resp.iter_content(chunk_size=1024*256)):
+            if offset + len(chunk) > end + 1:
+                raise MirrorError("Upstream sent more bytes than requested")
+            os.pwrite(fd, chunk, offset)
+            offset += len(chunk)
+    finally:
+        resp.close()
+    if offset != end + 1:
+        raise MirrorError(f"Short read for bytes {start}-{end}")
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _pick_source(episode):
+    dead = dead_urls(episode)
+    candidates = [url for url in episode.sources if url not in dead] or episode.sources
+    ranked = health.rank(candidates)
+    return ranked[0] if ranked else candidates[0]
+
+
+def mirror_episode(episode_id):
+    """
+    Download an episode's video into MIRROR_DIR with parallel Range
+    requests, recording progress and the final SHA-256 on its
+    EpisodeMirror row. Safe to call again after a failure: finished pieces
+    are kept.
+    """
+    # hls needs the app's cache, which does not exist yet when this module loads
+    from app.services.hls import is_playlist
+
+    episode = Episode.query.get(episode_id)
+    if episode is None or not episode.video_url:
+        return
+
+    mirror = episode.mirror
+    if mirror is None:
+        mirror = EpisodeMirror(episode=episode, source_url=episode.video_url.strip())
+        db.session.add(mirror)
+    elif mirror.status == 'downloading' and mirror.updated_at and datetime.utcnow() - mirror.updated_at < STALE_AFTER:
+        # Another worker is on it
+        return
+
+    url = _pick_source(episode)
+    mirror.source_url = url
+    mirror.path = local_path(url)
+    mirror.status = 'downloading'
+    mirror.error = None
+    mirror.started_at = datetime.utcnow()
+    db.session.commit()
+
+    try:
+        if is_playlist(url):
+            raise MirrorError("HLS playlists cannot be mirrored")
+        _download(mirror, url)
+    except (MirrorError, OSError, requests.exceptions.RequestException) as e:
+        current_app.logger.warning(f"Mirroring episode {episode_id} failed: {e}")
+        mirror.status = 'failed'
+        mirror.error = str(e)[:255]
+        db.session.commit()
+        return
+
+    mirror.status = 'complete'
+    mirror.completed_at = datetime.utcnow()
+    db.session.commit()
+
+
+def _download(mirror, url):
+    path = mirror.path
+    if os.path.exists(path):
+        mirror.size = mirror.bytes_done = os.path.getsize(path)
+        mirror.sha256 = mirror.sha256 or file_sha256(path)
+        return
+
+    probe = probe_url(url)
+    if not probe['ok']:
+        raise MirrorError(probe['error'] or "Source is unreachable")
+    if probe['status_code'] != 206 or not probe['content_length']:
+        raise MirrorError("Source does not support range requests")
+
+    size = probe['content_length']
+    piece_bytes = current_app.config['MIRROR_PIECE_BYTES']
+    pieces = [(i, start, min(start + piece_bytes, size) - 1)
+              for i, start in enumerate(range(0, size, piece_bytes))]
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    part_path = f"{path}.part"
+    progress = _Progress(f"{part_path}.json", url, size)
+    if not os.path.exists(part_path):
+        progress.done.clear()
+
+    mirror.size = size
+    mirror.bytes_done = sum(end - start + 1 for i, start, end in pieces if i in progress.done)
+    db.session.commit()
+
+    fd = os.open(part_path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        os.ftruncate(fd, size)
+        todo = [piece for piece in pieces if piece[0] not in progress.done]
+        errors = []
+        workers = current_app.config['MIRROR_CONNECTIONS']
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='mirror-piece') as executor:
+            futures = {executor.submit(_download_piece, url, fd, start, end): (i, start, end)
+                       for i, start, end in todo}
+            for future in as_completed(futures):
+                i, start, end = futures[future]
+                try:
+                    future.result()
+                except (MirrorError, OSError, requests.exceptions.RequestException) as e:
+                    errors.append(e)
+                    continue
+                progress.add(i)
+                mirror.bytes_done += end - start + 1
+                db.session.commit()
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+    if errors:
+        raise MirrorError(f"{len(errors)} of {len(todo)} pieces failed, e.g. {errors[0]}")
+
+    mirror.sha256 = file_sha256(part_path)
+    os.replace(part_path, path)
+    try:
+        os.remove(progress.path)
+    except OSError:
+        pass
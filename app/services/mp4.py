@@ -0,0 +1,99 @@
+import struct
+
+# Top-level boxes we expect in a progressive MP4
+CONTAINER_TYPES = (b'ftyp', b'moov', b'mdat', b'free', b'skip', b'wide', b'uuid', b'pdin', b'moof', b'mfra', b'sidx', b'styp', b'meta')
+
+
+class Box:
+    def __init__(self, box_type, offset, size, header_size):
+        self.type = box_type
+        self.offset = offset
+        self.size = size
+        self.header_size = header_size
+
+    @property
+    def end(self):
+        return self.offset + self.size
+
+    def __repr__(self):
+        return f"<Box {self.type.decode('latin-1')} @{self.offset} size={self.size}>"
+
+
+def iter_boxes(read, file_size, start=0, end=None):
+    """
+    Walk the boxes between start and end using `read(offset, length)`, which
+    only has to return the 16 header bytes of each box.
+    """
+    offset = start
+    end = file_size if end is None else end
+    while offset + 8 <= end:
+        header = read(offset, 16)
+        if len(header) < 8:
+            return
+        size, box_type = struct.unpack('>I4s', header[:8])
+        header_size = 8
+        if size == 1:
+            if len(header) < 16:
+                return
+            size = struct.unpack('>Q', header[8:16])[0]
+            header_size = 16
+        elif size == 0:
+            # Box runs to the end of the file
+            size = end - offset
+        if size < header_size:
+            return
+        yield Box(box_type, offset, size, header_size)
+        offset += size
+
+
+def top_level_boxes(read, file_size):
+    boxes = []
+    for box in iter_boxes(read, file_size):
+        if box.type not in CONTAINER_TYPES:
+            # Not an MP4 (or corrupt); stop before we wander through garbage
+            break
+        boxes.append(box)
+    return boxes
+
+
+def find_box(boxes, box_type):
+    for box in boxes:
+        if box.type == box_type:
+            return box
+    return None
+
+
+# Boxes on the path from moov down to the chunk offset tables
+OFFSET_TABLE_PARENTS = (b'moov', b'trak', b'mdia', b'minf', b'stbl')
+
+
+def shift_chunk_offsets(moov, start, end, delta):
+    """
+    Return a copy of an in-memory moov box with `delta` added to every
+    stco/co64 chunk offset that falls in [start, end). Raises ValueError if a
+    32-bit stco offset would overflow.
+    """
+    data = bytearray(moov)
+
+    def read(offset, length):
+        return bytes(data[offset:offset + length])
+
+    def walk(begin, stop):
+        for box in iter_boxes(read, len(data), begin, stop):
+            body = box.offset + box.header_size
+            if box.type in OFFSET_TABLE_PARENTS:
+                walk(body, box.end)
+            elif box.type in (b'stco', b'co64'):
+                # FullBox: version/flags, entry_count, then the offsets
+                count = struct.unpack_from('>I', data, body + 4)[0]
+                fmt = f">{count}{'I' if box.type == b'stco' else 'Q'}"
+                offsets = list(struct.unpack_from(fmt, data, body + 8))
+                for i, offset in enumerate(offsets):
+                    if start <= offset < end:
+                        offsets[i] = offset + delta
+                if box.type == b'stco' and offsets and max(offsets) > 0xFFFFFFFF:
+                    raise ValueError("Chunk offset does not fit in stco")
+                struct.pack_into(fmt, data, body + 8, *offsets)
+
+    walk(0, len(data))
+    return bytes(data)
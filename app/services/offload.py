@@ -0,0 +1,63 @@
+import os
+from urllib.parse import urlsplit, quote
+
+from flask import current_app, Response
+
+from app.services.http_cache import cache_control_for
+
+# MEDIA_OFFLOAD modes
+X_ACCEL = 'x-accel'
+X_SENDFILE = 'x-sendfile'
+
+
+def offload_mode():
+    return (current_app.config.get('MEDIA_OFFLOAD') or '').lower()
+
+
+def _response(header, target, mimetype=None, download_name=None):
+    # No body: the front server replaces it with the internal redirect target
+    response = Response(status=200, mimetype=mimetype)
+    response.headers[header] = target
+    if mimetype:
+        response.headers['Cache-Control'] = cache_control_for(mimetype)
+    if download_name:
+        response.headers['Content-Disposition'] = f'attachment; filename="{download_name}"'
+    return response
+
+
+def offload_file(path, mimetype=None, download_name=None):
+    """
+    Internal-redirect response for a local file, or None when offload is
+    disabled or the file lives outside MEDIA_OFFLOAD_ROOT.
+    """
+    mode = offload_mode()
+    if mode == X_SENDFILE:
+        return _response('X-Sendfile', os.path.abspath(path), mimetype, download_name)
+    if mode != X_ACCEL:
+        return None
+
+    root = os.path.abspath(current_app.config.get('MEDIA_OFFLOAD_ROOT') or current_app.instance_path)
+    path = os.path.abspath(path)
+    if os.path.commonpath([root, path]) != root:
+        return None
+    relative = os.path.relpath(path, root).replace(os.sep, '/')
+    prefix = current_app.config['MEDIA_OFFLOAD_FILE_PREFIX'].rstrip('/')
+    return _response('X-Accel-Redirect', f"{prefix}/{quote(relative)}", mimetype, download_name)
+
+
+def offload_upstream(url, mimetype=None, download_name=None):
+    """
+    Internal-redirect response that makes nginx stream an upstream URL itself.
+    Only nginx can proxy remote URLs, so this is None outside x-accel mode.
+    """
+    if offload_mode() != X_ACCEL:
+        return None
+
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.netloc:
+        return None
+    prefix = current_app.config['MEDIA_OFFLOAD_UPSTREAM_PREFIX'].rstrip('/')
+    target = f"{prefix}/{parts.scheme}/{parts.netloc}{parts.path or '/'}"
+    if parts.query:
+        target += f"?{parts.query}"
+    return _response('X-Accel-Redirect', target, mimetype, download_name)
@@ -0,0 +1,125 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+from flask import current_app
+
+from app.models import db, Episode, LinkProbe
+from app.services.upstream import upstream
+
+
+def probe_url(url):
+    """
+    Check one upstream URL with a single-byte Range request (many CDNs
+    reject HEAD). Returns the fields of a LinkProbe row.
+    """
+    started = time.monotonic()
+    try:
+        resp = upstream.get(url, headers={'Range': 'bytes=0-0'})
+    except requests.exceptions.RequestException as e:
+        return {'ok': False, 'status_code': None, 'content_length': None, 'content_type': None,
+                'latency_ms': int((time.monotonic() - started) * 1000), 'error': str(e)[:255]}
+    latency_ms = int((time.monotonic() - started) * 1000)
+    resp.close()
+
+    content_length = None
+    content_range = resp.headers.get('Content-Range', '')
+    if '/' in content_range and content_range.rsplit('/', 1)[1].isdigit():
+        content_length = int(content_range.rsplit('/', 1)[1])
+    elif resp.status_code == 200 and resp.headers.get('Content-Length', '').isdigit():
+        content_length = int(resp.headers['Content-Length'])
+
+    ok = resp.status_code < 400
+    return {
+        'ok': ok,
+        'status_code': resp.status_code,
+        'content_length': content_length,
+        'content_type': (resp.headers.get('Content-Type') or '')[:255] or None,
+        'latency_ms': latency_ms,
+        'error': None if ok else f"HTTP {resp.status_code}",
+    }
+
+
+def episode_links(episode):
+    links = []
+    for index, url in enumerate(episode.sources):
+        links.append(('video' if index == 0 else 'mirror', url))
+    if episode.subtitle_url:
+        links.append(('subtitle', episode.subtitle_url.strip()))
+    return links
+
+
+def probe_episodes(episodes, workers=None):
+    """
+    Probe every video, mirror and subtitle URL of the given episodes with a
+    bounded pool and store the results. Returns (checked, broken) counts.
+    """
+    workers = workers or current_app.config['LINK_PROBE_WORKERS']
+    jobs = [(episode, kind, url) for episode in episodes for kind, url in episode_links(episode)]
+
+    # Threads only do HTTP; all database work stays on this thread
+    app = current_app._get_current_object()
+
+    def run(url):
+        with app.app_context():
+            return probe_url(url)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='link-probe') as executor:
+        results = list(executor.map(run, [url for _, _, url in jobs]))
+
+    by_episode = {}
+    for (episode, kind, url), result in zip(jobs, results):
+        by_episode.setdefault(episode, []).append((kind, url, result))
+
+    broken = 0
+    for episode in episodes:
+        results = by_episode.get(episode, [])
+        _store(episode, results)
+        broken += sum(1 for _, _, result in results if not result['ok'])
+    db.session.commit()
+    return len(jobs), broken
+
+
+def _store(episode, results):
+    existing = {probe.url: probe for probe in episode.probes}
+    now = datetime.utcnow()
+    for kind, url, result in results:
+        probe = existing.pop(url, None)
+        if probe is None:
+            probe = LinkProbe(url=url)
+            episode.probes.append(probe)
+        probe.kind = kind
+        probe.checked_at = now
+        for field, value in result.items():
+            setattr(probe, field, value)
+    # URLs that were edited away since the last run
+    for probe in existing.values():
+        episode.probes.remove(probe)
+
+
+def probe_movie(movie_id):
+    episodes = Episode.query.filter_by(movie_id=movie_id).all()
+    return probe_episodes(episodes)
+
+
+def dead_urls(episode):
+    """
+    URLs of an episode whose most recent probe failed.
+    """
+    return {probe.url for probe in episode.probes if not probe.ok}
+
+
+def link_status(probes):
+    """
+    Summarise an episode's probes for the admin list: 'unchecked', 'dead',
+    'slow' or 'ok'.
+    """
+    if not probes:
+        return 'unchecked'
+    if any(not probe.ok for probe in probes):
+        return 'dead'
+    slow_ms = current_app.config['LINK_PROBE_SLOW_MS']
+    if any(probe.latency_ms and probe.latency_ms > slow_ms for probe in probes):
+        return 'slow'
+    return 'ok'
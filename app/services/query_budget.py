@@ -0,0 +1,55 @@
+from flask import current_app, g, has_request_context, request, request_started
+from sqlalchemy import event
+
+from app.models import db
+
+
+class QueryBudget:
+    """
+    Counts the SQL statements each request runs and logs requests that run
+    more than SQL_QUERY_BUDGET. Listing pages load their relations in
+    batches, so their count stays the same whatever the page size; a lazy
+    load in a template loop (one query per row) shows up here first.
+    """
+
+    def __init__(self):
+        self.budget = 0
+
+    def init_app(self, app):
+        self.budget = app.config.get('SQL_QUERY_BUDGET', self.budget)
+        app.extensions['query_budget'] = self
+        if not self.budget:
+            return
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', self._count)
+        # g lives on the app context, which tests and CLI commands keep
+        # pushed across requests: start every request from zero
+        request_started.connect(self._reset, app)
+        app.after_request(self._check)
+
+    @staticmethod
+    def _reset(sender, **extra):
+        g.sql_queries = 0
+
+    @staticmethod
+    def _count(conn, cursor, statement, parameters, context, executemany):
+        if has_request_context():
+            g.sql_queries = g.get('sql_queries', 0) + 1
+
+    def _check(self, response):
+        # Streamed bodies may still query after this point; they are not counted
+        count = self.count()
+        if count > self.budget:
+            current_app.logger.warning(f"{request.method} {request.path} ({request.endpoint}) ran "
+                                       f"{count} SQL queries, budget is {self.budget}")
+        return response
+
+    @staticmethod
+    def count():
+        """
+        Statements run so far by the current request.
+        """
+        return g.get('sql_queries', 0)
+
+
+query_budget = QueryBudget()
@@ -0,0 +1,123 @@
+import re
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from app.models import db, Movie, Episode, User, Favorite, Transaction
+from app.pagination import encode_cursor
+
+# Tables small enough by nature (or pre-aggregated) that scanning them is fine
+SMALL_TABLES = {'site_settings', 'subscription_plans', 'alembic_version', 'daily_stats', 'daily_plan_revenue'}
+
+SQLITE_SCAN_RE = re.compile(r'^SCAN (\w+)(?: AS \w+)?$')
+
+
+@contextmanager
+def capture_statements():
+    """
+    Collect (statement, parameters) of every SQL statement executed on the
+    engine inside the block.
+    """
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if not executemany:
+            statements.append((statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+
+
+def hot_pages():
+    """
+    GET URLs of the main and admin blueprints to check, including deep
+    keyset pages, built from whatever rows the database has.
+    """
+    pages = ['/', '/search?q=cinta', '/sitemap.xml', '/profile', '/history', '/favorites',
+             '/admin/', '/admin/movies', '/admin/movies?q=cinta', '/admin/users', '/admin/plans',
+             '/admin/transactions', '/admin/transactions?status=paid']
+
+    listings = [('/', Movie), ('/admin/movies', Movie), ('/admin/users', User),
+                ('/admin/transactions', Transaction), ('/favorites', Favorite)]
+    for url, model in listings:
+        row = model.query.order_by(model.created_at.desc(), model.id.desc()).first()
+        if row is not None:
+            pages.append(f"{url}?cursor={encode_cursor('next', 2, row)}")
+            pages.append(f"{url}?cursor={encode_cursor('prev', 1, row)}")
+
+    movie = Movie.query.order_by(Movie.id).first()
+    if movie is not None:
+        pages += [f'/movie/{movie.id}', f'/admin/movies/{movie.id}/episodes']
+    episode = Episode.query.order_by(Episode.id).first()
+    if episode is not None:
+        pages.append(f'/watch/{episode.id}')
+    return pages
+
+
+def page_statements(client, pages):
+    """
+    GET every page with a test client. Returns {url: (status, statements)},
+    with the (statement, parameters) each page executed.
+    """
+    results = {}
+    with capture_statements() as captured:
+        for url in pages:
+            before = len(captured)
+            response = client.get(url)
+            response.close()
+            results[url] = (response.status_code, captured[before:])
+    return results
+
+
+def checked_statements(results):
+    """
+    The distinct SELECT/UPDATE/DELETE statements of page_statements()
+    results, each with the first page that ran it and its parameters.
+    """
+    statements = {}
+    for url, (status, executed) in results.items():
+        for statement, parameters in executed:
+            if statement.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE')):
+                statements.setdefault(statement, (url, parameters))
+    return statements
+
+
+def explain(connection, statement, parameters):
+    """
+    The query plan of a statement as a list of readable lines.
+    """
+    if connection.dialect.name == 'sqlite':
+        rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).fetchall()
+        return [row[-1] for row in rows]
+    rows = connection.exec_driver_sql(f"EXPLAIN {statement}", parameters).mappings().all()
+    return [f"{row['table']}: type={row['type']} key={row['key']} {row['Extra'] or ''}".strip() for row in rows]
+
+
+def plan_problems(statement, plan):
+    """
+    Full table scans and unindexed sorts in a plan. Statements without WHERE
+    or ORDER BY read the whole table on purpose (sitemap, search index
+    build, totals) and are not flagged.
+    """
+    sql = ' '.join(statement.split()).upper()
+    if ' WHERE ' not in sql and ' ORDER BY ' not in sql:
+        return []
+    limited = ' LIMIT ' in sql
+
+    problems = []
+    for line in plan:
+        match = SQLITE_SCAN_RE.match(line)
+        if match and match.group(1) not in SMALL_TABLES:
+            problems.append(line)
+        elif line.startswith('USE TEMP B-TREE FOR ORDER BY') and limited:
+            problems.append(line)
+        elif ': type=' in line:
+            table = line.split(':', 1)[0]
+            if table in SMALL_TABLES:
+                continue
+            if 'type=ALL' in line or ('Using filesort' in line and limited):
+                problems.append(line)
+    return problems
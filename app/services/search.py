@@ -0,0 +1,359 @@
+import bisect
+import heapq
+import math
+import re
+import threading
+import unicodedata
+
+from flask_sqlalchemy.pagination import Pagination
+
+from app.models import db, Movie
+from app.services.stamps import stamps
+
+STAMP = 'search'
+
+# Title matches count three times as much as description matches
+FIELD_WEIGHTS = {'title': 3.0, 'description': 1.0}
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Weight of a query term matched as a prefix (typing in progress) or with typos
+PREFIX_WEIGHT = 0.8
+TYPO_WEIGHTS = {1: 0.6, 2: 0.4}
+MAX_EXPANSIONS = 30
+
+STOPWORDS = frozenset("""
+    yang dan di ke dari untuk dengan ini itu atau pada dalam adalah juga akan
+    the a an of and or to in on for is with
+""".split())
+# Indonesian particles and possessives, stripped so "cintanya" finds "cinta"
+SUFFIXES = ('nya', 'lah', 'kah')
+
+CJK_RE = re.compile(r'([\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+)')
+WORD_RE = re.compile(r'[^\W_]+')
+
+
+def _normalize(text):
+    # Decompose and drop combining marks: pinyin tone marks ("Xiāo") and
+    # accents fold to plain letters
+    text = unicodedata.normalize('NFKD', text or '')
+    return ''.join(ch for ch in text if not unicodedata.combining(ch)).casefold()
+
+
+def _stem(word):
+    for suffix in SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 4:
+            return word[:-len(suffix)]
+    return word
+
+
+def analyze(text):
+    """
+    Split text into index terms, each with the base terms it covers.
+    Latin words are lowercased, stripped of tone marks and Indonesian
+    particles; runs of Chinese characters become single characters plus
+    overlapping bigrams, since they have no spaces. Adjacent short words
+    are also joined ("wu lin" -> "wulin") so spaced and unspaced pinyin
+    match each other.
+    """
+    terms = []
+    previous = None
+    for word in WORD_RE.findall(_normalize(text)):
+        for part in CJK_RE.split(word):
+            if not part:
+                continue
+            if CJK_RE.fullmatch(part):
+                terms.extend((ch, (ch,)) for ch in part)
+                terms.extend((part[i:i + 2], (part[i], part[i + 1])) for i in range(len(part) - 1))
+                previous = None
+                continue
+            if part in STOPWORDS:
+                previous = None
+                continue
+            term = _stem(part)
+            terms.append((term, (term,)))
+            if previous and len(previous) <= 6 and len(term) <= 6 and not term.isdigit():
+                terms.append((previous + term, (previous, term)))
+            previous = term
+    return terms
+
+
+def _trigrams(term):
+    padded = f"${term}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _edit_distance(a, b, limit):
+    """
+    Damerau-Levenshtein distance between a and b, or limit + 1 once it is
+    known to exceed limit.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i] + [0] * len(b)
+        for j, cb in enumerate(b, 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb))
+            if previous2 is not None and i > 1 and j > 1 and ca == b[j - 2] and a[i - 2] == cb:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+class SearchIndex:
+    """
+    In-process inverted index over movie titles and descriptions, ranked
+    with BM25 and tolerant of typos and partially typed words.
+
+    Each worker builds its index from the database on first use. Movie CRUD
+    updates the index of the worker handling it and bumps the 'search'
+    stamp, so the other workers rebuild on their next search.
+    """
+
+    def __init__(self):
+        self.max_results = 500
+        self._lock = threading.RLock()
+        self._stamp = None
+        self._built = False
+        self._reset()
+
+    def init_app(self, app):
+        self.max_results = app.config.get('SEARCH_MAX_RESULTS', self.max_results)
+        app.extensions['search_index'] = self
+
+    def _reset(self):
+        self._postings = {}    # term -> {movie_id: weighted term frequency}
+        self._documents = {}   # movie_id -> ({term: weighted frequency}, base terms)
+        self._lengths = {}     # movie_id -> weighted document length
+        self._total_length = 0.0
+        self._norms = None     # movie_id -> BM25 length normalisation, built lazily
+        # Words that occur on their own (not only joined or as bigrams): the
+        # only terms prefix and typo matching expand to
+        self._vocabulary = {}  # term -> number of movies
+        self._trigram_terms = {}
+        self._sorted_terms = []
+
+    # --- Maintenance ---
+
+    def _ensure_fresh(self):
+        stamp = stamps.read(STAMP)
+        if self._built and stamp == self._stamp:
+            return
+        with self._lock:
+            if self._built and stamp == self._stamp:
+                return
+            self._reset()
+            rows = db.session.query(Movie.id, Movie.title, Movie.description).all()
+            for movie_id, title, description in rows:
+                self._add(movie_id, title, description, bulk=True)
+            self._sorted_terms = sorted(self._vocabulary)
+            self._stamp = stamp
+            self._built = True
+
+    def _add(self, movie_id, title, description, bulk=False):
+        frequencies = {}
+        base_terms = set()
+        for field, text in (('title', title), ('description', description)):
+            for term, parts in analyze(text):
+                frequencies[term] = frequencies.get(term, 0.0) + FIELD_WEIGHTS[field]
+                if parts == (term,):
+                    base_terms.add(term)
+        if not frequencies:
+            return
+        for term, frequency in frequencies.items():
+            self._postings.setdefault(term, {})[movie_id] = frequency
+        for term in base_terms:
+            if term not in self._vocabulary:
+                self._vocabulary[term] = 0
+                self._add_term(term, bulk)
+            self._vocabulary[term] += 1
+        self._documents[movie_id] = (frequencies, base_terms)
+        self._lengths[movie_id] = sum(frequencies.values())
+        self._total_length += self._lengths[movie_id]
+        self._norms = None
+
+    def _remove(self, movie_id):
+        document = self._documents.pop(movie_id, None)
+        if document is None:
+            return
+        frequencies, base_terms = document
+        for term in frequencies:
+            postings = self._postings[term]
+            del postings[movie_id]
+            if not postings:
+                del self._postings[term]
+        for term in base_terms:
+            self._vocabulary[term] -= 1
+            if not self._vocabulary[term]:
+                del self._vocabulary[term]
+                self._remove_term(term)
+        self._total_length -= self._lengths.pop(movie_id)
+        self._norms = None
+
+    def _add_term(self, term, bulk=False):
+        # A full rebuild sorts the vocabulary once at the end instead
+        if not bulk:
+            bisect.insort(self._sorted_terms, term)
+        for trigram in _trigrams(term):
+            self._trigram_terms.setdefault(trigram, set()).add(term)
+
+    def _remove_term(self, term):
+        index = bisect.bisect_left(self._sorted_terms, term)
+        if index < len(self._sorted_terms) and self._sorted_terms[index] == term:
+            del self._sorted_terms[index]
+        for trigram in _trigrams(term):
+            terms = self._trigram_terms.get(trigram)
+            if terms is not None:
+                terms.discard(term)
+                if not terms:
+                    del self._trigram_terms[trigram]
+
+    def update(self, movie):
+        """
+        Reindex one movie after it was added or edited (and committed).
+        """
+        self._ensure_fresh()
+        with self._lock:
+            self._remove(movie.id)
+            self._add(movie.id, movie.title, movie.description)
+            self._publish()
+
+    def remove(self, movie_id):
+        self._ensure_fresh()
+        with self._lock:
+            self._remove(movie_id)
+            self._publish()
+
+    def _publish(self):
+        stamps.bump(STAMP)
+        self._stamp = stamps.read(STAMP)
+
+    # --- Querying ---
+
+    def _expand(self, term):
+        """
+        Index terms a query word stands for, with their weights: the word
+        itself, words it is a prefix of, and words within a small edit
+        distance.
+        """
+        expansions = {}
+        if term in self._postings:
+            expansions[term] = 1.0
+
+        if len(term) >= 2:
+            start = bisect.bisect_left(self._sorted_terms, term)
+            for candidate in self._sorted_terms[start:start + MAX_EXPANSIONS]:
+                if not candidate.startswith(term):
+                    break
+                expansions.setdefault(candidate, PREFIX_WEIGHT)
+
+        # Typo matching only for words the index doesn't know
+        if term not in self._vocabulary and len(term) >= 4 and not CJK_RE.search(term):
+            limit = 1 if len(term) < 8 else 2
+            shared = {}
+            for trigram in _trigrams(term):
+                for candidate in self._trigram_terms.get(trigram, ()):
+                    shared[candidate] = shared.get(candidate, 0) + 1
+            candidates = sorted(shared, key=shared.get, reverse=True)[:MAX_EXPANSIONS * 4]
+            for candidate in candidates:
+                if candidate in expansions:
+                    continue
+                distance = _edit_distance(term, candidate, limit)
+                if distance <= limit:
+                    expansions[candidate] = TYPO_WEIGHTS[distance]
+        return expansions
+
+    def _length_norms(self):
+        if self._norms is None:
+            average = self._total_length / len(self._documents)
+            self._norms = {movie_id: BM25_K1 * (1 - BM25_B + BM25_B * length / average)
+                           for movie_id, length in self._lengths.items()}
+        return self._norms
+
+    def search(self, query, limit=None):
+        """
+        Movie ids matching `query`, best first.
+        """
+        self._ensure_fresh()
+        terms = dict(analyze(query))
+        # Joined words and bigrams only add evidence for the words they cover
+        base_terms = [term for term, parts in terms.items() if parts == (term,)]
+        if not base_terms:
+            return []
+        bits = {term: 1 << i for i, term in enumerate(base_terms)}
+
+        with self._lock:
+            count = len(self._documents)
+            if not count:
+                return []
+            norms = self._length_norms()
+            scores = {}
+            matched = {}
+            for term, parts in terms.items():
+                if parts == (term,):
+                    expansions = self._expand(term)
+                else:
+                    expansions = {term: 1.0} if term in self._postings else {}
+                # Per movie, a word counts once: through its best matching term
+                best = {}
+                for candidate, weight in expansions.items():
+                    postings = self._postings[candidate]
+                    idf = weight * math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                    for movie_id, frequency in postings.items():
+                        score = idf * frequency * (BM25_K1 + 1) / (frequency + norms[movie_id])
+                        if score > best.get(movie_id, 0.0):
+                            best[movie_id] = score
+                mask = sum(bits.get(part, 0) for part in set(parts))
+                for movie_id, score in best.items():
+                    scores[movie_id] = scores.get(movie_id, 0.0) + score
+                    matched[movie_id] = matched.get(movie_id, 0) | mask
+
+        # Movies matching every query word come before partial matches
+        def rank(movie_id):
+            coverage = bin(matched[movie_id]).count('1') / len(base_terms)
+            return (coverage ** 2 * scores[movie_id], -movie_id)
+
+        return heapq.nlargest(limit or self.max_results, scores, key=rank)
+
+    def paginate(self, query, page=None, per_page=None):
+        """
+        Search results as a Flask-SQLAlchemy style pagination of movies.
+        """
+        return SearchPagination(page=page, per_page=per_page, movie_ids=self.search(query))
+
+    def stats(self):
+        with self._lock:
+            return {'movies': len(self._documents), 'terms': len(self._postings),
+                    'words': len(self._vocabulary), 'built': self._built}
+
+
+class SearchPagination(Pagination):
+    """
+    Pagination over a ranked list of movie ids. Only the movies on the
+    current page are loaded, in ranking order.
+    """
+
+    def _query_items(self):
+        movie_ids = self._query_args['movie_ids'][self._query_offset:self._query_offset + self.per_page]
+        if not movie_ids:
+            return []
+        movies = {movie.id: movie for movie in Movie.query.filter(Movie.id.in_(movie_ids))}
+        return [movies[movie_id] for movie_id in movie_ids if movie_id in movies]
+
+    def _query_count(self):
+        return len(self._query_args['movie_ids'])
+
+    @property
+    def prev_args(self):
+        return {'page': self.prev_num}
+
+    @property
+    def next_args(self):
+        return {'page': self.next_num}
+
+
+search_index = SearchIndex()
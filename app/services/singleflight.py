@@ -0,0 +1,202 @@
+import hashlib
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Non-POSIX: coalescing stays within one worker
+    fcntl = None
+
+class Flight:
+    """
+    One in-progress fetch. Waiters are woken as each key completes, so
+    followers get their bytes as soon as the leader stored them.
+    """
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.done = set()
+        self.finished = False
+
+    def mark(self, key):
+        with self.cond:
+            self.done.add(key)
+            self.cond.notify_all()
+
+    def finish(self):
+        with self.cond:
+            self.finished = True
+            self.cond.notify_all()
+
+    def wait(self, key, timeout):
+        with self.cond:
+            return self.cond.wait_for(lambda: key in self.done or self.finished, timeout)
+
+
+class SingleFlight:
+    """
+    Request coalescing for upstream fetches that land in a disk cache.
+
+    The first caller for a key becomes the leader and fetches. Concurrent
+    callers in the same worker wait on the leader's Flight; callers in other
+    gunicorn workers on the node see the leader's lock file held and poll the
+    disk until the result appears. Either way they then read the cached copy
+    instead of opening their own upstream fetch.
+    """
+
+    def __init__(self):
+        self.lock_dir = None
+        self.wait_timeout = 15
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._counters = {'leaders': 0, 'followers': 0, 'timeouts': 0}
+
+    def init_app(self, app):
+        self.lock_dir = app.config.get('SINGLEFLIGHT_LOCK_DIR') or os.path.join(app.instance_path, 'cache', 'locks')
+        self.wait_timeout = app.config.get('SINGLEFLIGHT_WAIT_TIMEOUT', self.wait_timeout)
+        app.extensions['singleflight'] = self
+
+    def _lock_path(self, key):
+        # One file per key: flock is per open file, so keys sharing a file
+        # would block each other even within one worker
+        return os.path.join(self.lock_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.lock')
+
+    def _try_file_lock(self, key):
+        if fcntl is None or self.lock_dir is None:
+            return -1
+        os.makedirs(self.lock_dir, exist_ok=True)
+        path = self._lock_path(key)
+        while True:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(fd)
+                return None
+            # The previous leader removes the file on release; if that
+            # happened after we opened it, we locked an orphan: retry
+            try:
+                if os.stat(path).st_ino == os.fstat(fd).st_ino:
+                    return fd
+            except FileNotFoundError:
+                pass
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def _release_file_lock(self, key, fd):
+        if fd is None or fd < 0:
+            return
+        try:
+            # Removed while still held, so the lock directory only holds
+            # the keys being fetched right now
+            os.unlink(self._lock_path(key))
+        except OSError:
+            pass
+        try:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+
+    def claim(self, keys):
+        """
+        Become leader for the longest prefix of `keys` nobody else is
+        fetching. Returns (flight, claimed) where claimed may be empty.
+        """
+        claimed = []
+        flight = Flight()
+        with self._lock:
+            for key in keys:
+                if key in self._flights:
+                    break
+                fd = self._try_file_lock(key)
+                if fd is None:
+                    break
+                claimed.append((key, fd))
+                self._flights[key] = flight
+            if claimed:
+                self._counters['leaders'] += 1
+        return flight, claimed
+
+    def release(self, flight, claimed):
+        with self._lock:
+            for key, fd in claimed:
+                self._flights.pop(key, None)
+                self._release_file_lock(key, fd)
+        flight.finish()
+
+    def _locked_elsewhere(self, key):
+        if fcntl is None or self.lock_dir is None:
+            return False
+        try:
+            fd = os.open(self._lock_path(key), os.O_RDWR)
+        except FileNotFoundError:
+            return False
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return True
+        else:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            return False
+        finally:
+            os.close(fd)
+
+    def wait(self, key, ready, timeout=None):
+        """
+        Wait until `ready()` is true or nobody is fetching `key` anymore.
+        """
+        timeout = self.wait_timeout if timeout is None else timeout
+        with self._lock:
+            self._counters['followers'] += 1
+            flight = self._flights.get(key)
+
+        if flight is not None:
+            if not flight.wait(key, timeout):
+                self._count_timeout()
+            return ready()
+
+        # Leader lives in another worker: watch the disk and its lock file
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if ready():
+                return True
+            with self._lock:
+                in_process = key in self._flights
+            if not in_process and not self._locked_elsewhere(key):
+                return ready()
+            time.sleep(0.05)
+        self._count_timeout()
+        return ready()
+
+    def run(self, key, fn, ready, timeout=None):
+        """
+        Call fn() unless ready(). Concurrent callers for the same key wait for
+        the leader instead; if the leader fails they fall back to fn().
+        """
+        if ready():
+            return
+        flight, claimed = self.claim([key])
+        if not claimed:
+            if self.wait(key, ready, timeout):
+                return
+            fn()
+            return
+        try:
+            if not ready():
+                fn()
+        finally:
+            self.release(flight, claimed)
+
+    def _count_timeout(self):
+        with self._lock:
+            self._counters['timeouts'] += 1
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+            counters['in_flight'] = len(self._flights)
+        return counters
+
+
+singleflight = SingleFlight()
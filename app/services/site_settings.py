@@ -0,0 +1,51 @@
+import threading
+
+from app.models import SiteSettings
+from app.services.stamps import stamps
+
+STAMP = 'site_settings'
+
+
+class SiteSettingsCache:
+    """
+    The SiteSettings row, loaded once per process and kept in memory.
+
+    Every worker checks the 'site_settings' stamp before using its copy, so
+    a save in the admin (which bumps the stamp) reaches all workers on their
+    next request without any per-request query.
+    """
+
+    def __init__(self):
+        self._settings = None
+        self._stamp = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        app.extensions['site_settings'] = self
+
+    def get(self):
+        stamp = stamps.read(STAMP)
+        if self._loaded and self._stamp == stamp:
+            return self._settings
+        with self._lock:
+            if not self._loaded or self._stamp != stamp:
+                # Read the stamp before the row: a save that lands in between
+                # leaves us with an older stamp, so the next call reloads
+                self._settings = self._load()
+                self._stamp = stamp
+                self._loaded = True
+            return self._settings
+
+    def _load(self):
+        row = SiteSettings.query.first()
+        if row is None:
+            return None
+        # A detached copy, so requests never share (or expire) a session object
+        return SiteSettings(**{column.key: getattr(row, column.key) for column in SiteSettings.__table__.columns})
+
+    def invalidate(self):
+        stamps.bump(STAMP)
+
+
+site_settings = SiteSettingsCache()
@@ -0,0 +1,47 @@
+import os
+import uuid
+
+
+class Stamps:
+    """
+    Version stamps shared by every gunicorn worker on the node.
+
+    A stamp is a tiny file that is atomically replaced whenever the data it
+    guards changes. Per-process caches remember the stamp they were built
+    from and reload once it differs, so checking freshness costs one stat()
+    instead of a database query.
+    """
+
+    def __init__(self):
+        self.root = None
+
+    def init_app(self, app):
+        self.root = app.config.get('STAMP_DIR') or os.path.join(app.instance_path, 'cache', 'stamps')
+        os.makedirs(self.root, exist_ok=True)
+        app.extensions['stamps'] = self
+
+    def _path(self, name):
+        return os.path.join(self.root, name)
+
+    def read(self, name):
+        """
+        The current version of `name`, or None if it was never bumped.
+        """
+        try:
+            st = os.stat(self._path(name))
+        except FileNotFoundError:
+            return None
+        # A bump replaces the file, so the inode changes even when two bumps
+        # land within the filesystem's mtime resolution
+        return (st.st_ino, st.st_mtime_ns)
+
+    def bump(self, name):
+        path = self._path(name)
+        token = uuid.uuid4().hex
+        tmp_path = f"{path}.{token}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(token)
+        os.replace(tmp_path, path)
+
+
+stamps = Stamps()
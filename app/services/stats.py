@@ -0,0 +1,227 @@
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from sqlalchemy import func, update, delete, insert
+from sqlalchemy.exc import IntegrityError
+
+from app.models import db, User, Transaction, SubscriptionPlan, DailyStat, DailyPlanRevenue
+
+# Plan id stored for paid transactions without a plan
+NO_PLAN = 0
+
+
+def _day(moment=None):
+    return (moment or datetime.utcnow()).date()
+
+
+def _as_date(value):
+    # func.date() returns strings on SQLite and dates on MySQL
+    return value if isinstance(value, date) else date.fromisoformat(value)
+
+
+def _upsert(model, key, changes, initial):
+    """
+    Apply `changes` to the rollup row `key`, or insert it with `initial`.
+    Runs inside the caller's transaction, so the rollup commits (or rolls
+    back) together with the change it counts.
+    """
+    statement = update(model).filter_by(**key).values(changes).execution_options(synchronize_session=False)
+    if db.session.execute(statement).rowcount:
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.add(model(**key, **initial))
+    except IntegrityError:
+        # Another request created the row first
+        db.session.execute(statement)
+
+
+def _bump(model, key, **increments):
+    _upsert(model, key, {name: getattr(model, name) + amount for name, amount in increments.items()}, increments)
+
+
+def record_signup(user):
+    """
+    Count a new user. Call after adding the user, before committing.
+    """
+    _bump(DailyStat, {'day': _day(user.created_at)}, signups=1)
+
+
+def record_transaction(transaction):
+    """
+    Count a new (pending) transaction. Call once it has been created.
+    """
+    _bump(DailyStat, {'day': _day(transaction.created_at)}, transactions=1)
+
+
+def record_payment(transaction):
+    """
+    Count a transaction that just became paid and refresh today's active
+    subscribers. Call after updating the subscription, before committing.
+    Revenue is booked on the day the order was placed, like the backfill.
+    """
+    day = _day(transaction.created_at)
+    amount = transaction.amount or Decimal(0)
+    _bump(DailyStat, {'day': day}, paid_transactions=1, revenue=amount)
+    _bump(DailyPlanRevenue, {'day': day, 'plan_id': transaction.plan_id or NO_PLAN},
+          paid_transactions=1, revenue=amount)
+    refresh_active_subscribers()
+
+
+def count_active_subscribers(now=None):
+    return User.query.filter(User.subscription_end_date > (now or datetime.utcnow())).count()
+
+
+def refresh_active_subscribers():
+    """
+    Store the current number of running subscriptions on today's row.
+    Subscriptions also end silently, so `flask rollup-stats` refreshes this
+    from cron too.
+    """
+    active = count_active_subscribers()
+    _upsert(DailyStat, {'day': _day()}, {'active_subscribers': active}, {'active_subscribers': active})
+    return active
+
+
+def _per_day(created_at, *columns, filters=(), group_by=()):
+    day = func.date(created_at)
+    query = db.session.query(day, *group_by, *columns).filter(created_at.isnot(None), *filters)
+    return [(_as_date(row[0]), *row[1:]) for row in query.group_by(day, *group_by)]
+
+
+def _subscription_periods():
+    """
+    (start, end) of every subscription period, rebuilt from paid
+    transactions and plan durations the same way payments extend a
+    subscription. Manual edits of end dates are not visible here.
+    """
+    durations = dict(db.session.query(SubscriptionPlan.id, SubscriptionPlan.duration_days))
+    payments = (db.session.query(Transaction.user_id, Transaction.plan_id, Transaction.created_at)
+                .filter(Transaction.status == 'paid', Transaction.created_at.isnot(None))
+                .order_by(Transaction.user_id, Transaction.created_at))
+    user_id = start = end = None
+    for payer, plan_id, paid_at in payments:
+        if plan_id not in durations:
+            continue
+        if payer != user_id or end < paid_at:
+            if user_id is not None:
+                yield start, end
+            user_id, start, end = payer, paid_at, paid_at
+        try:
+            end += timedelta(days=durations[plan_id])
+        except OverflowError:
+            end = datetime.max
+    if user_id is not None:
+        yield start, end
+
+
+def _active_history(first_day, last_day):
+    """
+    Active subscribers at the end of each day from first_day to last_day.
+    """
+    changes = defaultdict(int)
+    for start, end in _subscription_periods():
+        # Active at the end of day d while start <= end of d < end
+        stop = end.date() if end.time() > datetime.min.time() else end.date() - timedelta(days=1)
+        if start.date() < stop:
+            changes[start.date()] += 1
+            changes[stop] -= 1
+
+    history = {}
+    active = sum(change for day, change in changes.items() if day < first_day)
+    day = first_day
+    while day <= last_day:
+        active += changes.get(day, 0)
+        history[day] = active
+        day += timedelta(days=1)
+    return history
+
+
+def backfill():
+    """
+    Rebuild every rollup row from the users and transactions tables.
+    Returns the number of days written.
+    """
+    rows = defaultdict(lambda: {'signups': 0, 'transactions': 0, 'paid_transactions': 0,
+                                'revenue': Decimal(0), 'active_subscribers': None})
+    for day, count in _per_day(User.created_at, func.count(User.id)):
+        rows[day]['signups'] = count
+    for day, count in _per_day(Transaction.created_at, func.count(Transaction.id)):
+        rows[day]['transactions'] = count
+
+    plan_rows = []
+    plan_id = func.coalesce(Transaction.plan_id, NO_PLAN)
+    for day, plan, count, revenue in _per_day(Transaction.created_at, func.count(Transaction.id),
+                                              func.sum(Transaction.amount), filters=[Transaction.status == 'paid'],
+                                              group_by=[plan_id]):
+        revenue = Decimal(revenue or 0)
+        rows[day]['paid_transactions'] += count
+        rows[day]['revenue'] += revenue
+        plan_rows.append({'day': day, 'plan_id': plan, 'paid_transactions': count, 'revenue': revenue})
+
+    today = _day()
+    if rows:
+        for day, active in _active_history(min(rows), today).items():
+            rows[day]['active_subscribers'] = active
+    rows[today]['active_subscribers'] = count_active_subscribers()
+
+    db.session.execute(delete(DailyPlanRevenue))
+    db.session.execute(delete(DailyStat))
+    db.session.execute(insert(DailyStat), [{'day': day, **values} for day, values in sorted(rows.items())])
+    if plan_rows:
+        db.session.execute(insert(DailyPlanRevenue), plan_rows)
+    db.session.commit()
+    return len(rows)
+
+
+def summary(days=30):
+    """
+    Everything the admin dashboard shows, read from the rollup tables:
+    totals, one entry per day for the last `days` days and revenue per plan.
+    """
+    totals = db.session.query(
+        func.coalesce(func.sum(DailyStat.signups), 0),
+        func.coalesce(func.sum(DailyStat.transactions), 0),
+        func.coalesce(func.sum(DailyStat.paid_transactions), 0),
+        func.coalesce(func.sum(DailyStat.revenue), 0),
+    ).one()
+
+    today = _day()
+    first_day = today - timedelta(days=days - 1)
+    stored = {row.day: row for row in DailyStat.query.filter(DailyStat.day >= first_day)}
+    series = []
+    for offset in range(days):
+        day = first_day + timedelta(days=offset)
+        row = stored.get(day)
+        series.append({
+            'day': day,
+            'signups': row.signups if row else 0,
+            'paid_transactions': row.paid_transactions if row else 0,
+            'revenue': row.revenue if row else Decimal(0),
+            'active_subscribers': row.active_subscribers if row else None,
+        })
+
+    # Today's snapshot is only taken on payments and by the cron job
+    active = series[-1]['active_subscribers']
+    if active is None:
+        active = count_active_subscribers()
+        series[-1]['active_subscribers'] = active
+
+    names = dict(db.session.query(SubscriptionPlan.id, SubscriptionPlan.name))
+    plans = [{'plan_id': plan_id, 'name': names.get(plan_id), 'paid_transactions': count, 'revenue': revenue}
+             for plan_id, count, revenue in db.session.query(
+                 DailyPlanRevenue.plan_id,
+                 func.sum(DailyPlanRevenue.paid_transactions),
+                 func.sum(DailyPlanRevenue.revenue),
+             ).group_by(DailyPlanRevenue.plan_id).order_by(func.sum(DailyPlanRevenue.revenue).desc())]
+
+    return {
+        'total_users': totals[0],
+        'total_transactions': totals[1],
+        'paid_transactions': totals[2],
+        'total_revenue': totals[3],
+        'active_subscribers': active,
+        'series': series,
+        'plans': plans,
+    }
@@ -0,0 +1,239 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+
+import requests
+
+from app.models import Episode
+from app.services.disk_cache import DiskCache
+from app.services.singleflight import singleflight
+from app.services.upstream import upstream
+
+TIMING_RE = re.compile(
+    r'^\s*(?P<start>(?:\d+:)?\d{1,2}:\d{1,2}[,.]\d{1,3})\s*-->\s*'
+    r'(?P<end>(?:\d+:)?\d{1,2}:\d{1,2}[,.]\d{1,3})(?P<settings>.*)$'
+)
+# Inline SSA/ASS overrides that some SRT files carry, e.g. {\an8}
+SSA_TAG_RE = re.compile(r'\{\\[^}]*\}')
+FONT_TAG_RE = re.compile(r'</?font[^>]*>', re.IGNORECASE)
+
+logger = logging.getLogger(__name__)
+
+# Cue length used when a cue has no usable end time
+DEFAULT_CUE_MS = 2000
+
+
+class SubtitleError(Exception):
+    pass
+
+
+def decode_subtitle(data):
+    """
+    Decode subtitle bytes whose encoding nobody told us: honour a BOM, then
+    try UTF-8, then fall back to Windows-1252 (which never fails).
+    """
+    if data.startswith(b'\xef\xbb\xbf'):
+        return data[3:].decode('utf-8', errors='replace')
+    if data.startswith((b'\xff\xfe', b'\xfe\xff')):
+        return data.decode('utf-16', errors='replace')
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError:
+        return data.decode('cp1252', errors='replace')
+
+
+def _parse_time(value):
+    parts = value.replace(',', '.').split(':')
+    seconds, _, fraction = parts[-1].partition('.')
+    ms = int((fraction + '00')[:3])
+    total = int(seconds) * 1000 + ms
+    total += int(parts[-2]) * 60000
+    if len(parts) > 2:
+        total += int(parts[-3]) * 3600000
+    return total
+
+
+def _format_time(ms):
+    hours, ms = divmod(ms, 3600000)
+    minutes, ms = divmod(ms, 60000)
+    seconds, ms = divmod(ms, 1000)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}.{ms:03d}"
+
+
+def _clean_text(lines):
+    text = []
+    for line in lines:
+        line = FONT_TAG_RE.sub('', SSA_TAG_RE.sub('', line)).rstrip()
+        if not line:
+            continue
+        # "-->" inside cue text would end the cue early in a VTT parser
+        text.append(line.replace('-->', '->'))
+    return text
+
+
+def to_webvtt(text):
+    """
+    Convert SRT (or messy WebVTT) text into clean WebVTT.
+
+    Cues are re-timed into HH:MM:SS.mmm, sorted by start time, and cues with
+    a missing or inverted end time get one that stops before the next cue.
+    STYLE/REGION blocks of VTT sources are kept, NOTE blocks and numeric SRT
+    indices are dropped.
+    """
+    text = text.replace('\r\n', '\n').replace('\r', '\n')
+    blocks = re.split(r'\n\s*\n', text.strip())
+
+    header = []
+    cues = []
+    for block in blocks:
+        lines = block.split('\n')
+        if lines[0].startswith('WEBVTT'):
+            continue
+        if lines[0].startswith(('STYLE', 'REGION')) and not cues:
+            header.append(block)
+            continue
+        if lines[0].startswith('NOTE'):
+            continue
+
+        for i, line in enumerate(lines[:2]):
+            match = TIMING_RE.match(line)
+            if match:
+                break
+        else:
+            continue
+
+        cue_text = _clean_text(lines[i + 1:])
+        if not cue_text:
+            continue
+        start = _parse_time(match.group('start'))
+        end = _parse_time(match.group('end'))
+        cues.append([start, end, match.group('settings').strip(), cue_text])
+
+    cues.sort(key=lambda cue: cue[0])
+    for index, cue in enumerate(cues):
+        if cue[1] <= cue[0]:
+            next_start = cues[index + 1][0] if index + 1 < len(cues) else None
+            end = cue[0] + DEFAULT_CUE_MS
+            if next_start is not None and next_start > cue[0]:
+                end = min(end, next_start)
+            cue[1] = end
+
+    out = ['WEBVTT', '']
+    for block in header:
+        out.extend([block, ''])
+    for start, end, settings, cue_text in cues:
+        timing = f"{_format_time(start)} --> {_format_time(end)}"
+        if settings:
+            timing += f" {settings}"
+        out.append(timing)
+        out.extend(cue_text)
+        out.append('')
+    return '\n'.join(out)
+
+
+class SubtitleStore(DiskCache):
+    """
+    Converted subtitles, one WebVTT file (plus a gzipped copy) per episode.
+
+    Files are keyed by episode and a hash of the source URL, so editing an
+    episode's subtitle_url picks up the new file without any purge. The
+    strong ETag is the hash of the converted text.
+    """
+
+    def __init__(self):
+        super().__init__(max_bytes=256 * 1024 * 1024)
+        self.max_source_bytes = 5 * 1024 * 1024
+
+    def init_app(self, app):
+        self.root = app.config.get('SUBTITLE_CACHE_DIR') or os.path.join(app.instance_path, 'cache', 'subtitles')
+        self.max_bytes = app.config.get('SUBTITLE_CACHE_MAX_BYTES', self.max_bytes)
+        app.extensions['subtitles'] = self
+
+    def version(self, episode):
+        return hashlib.sha256(episode.subtitle_url.encode('utf-8')).hexdigest()[:16]
+
+    def _base_path(self, episode):
+        return os.path.join(self.root, str(episode.id), self.version(episode))
+
+    def get(self, episode):
+        """
+        Return (vtt_path, gzip_path, etag) for an episode, converting the
+        upstream subtitle first if needed.
+        """
+        if not episode.subtitle_url:
+            raise SubtitleError("Episode has no subtitle")
+
+        base = self._base_path(episode)
+        meta_path = f"{base}.json"
+        paths = (f"{base}.vtt", f"{base}.vtt.gz", meta_path)
+        singleflight.run(f"subtitle:{base}", lambda: self._convert(episode, base),
+                         ready=lambda: all(os.path.exists(path) for path in paths))
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            raise SubtitleError("Subtitle conversion failed")
+
+        self.touch(f"{base}.vtt")
+        self.touch(f"{base}.vtt.gz")
+        return f"{base}.vtt", f"{base}.vtt.gz", meta['etag']
+
+    def _convert(self, episode, base):
+        resp = upstream.get(episode.subtitle_url)
+        try:
+            if resp.status_code >= 400:
+                raise SubtitleError(f"Upstream returned {resp.status_code}")
+            data = bytearray()
+            for chunk in resp.iter_content(chunk_size=1024*64):
+                data.extend(chunk)
+                if len(data) > self.max_source_bytes:
+                    raise SubtitleError("Subtitle file too large")
+        finally:
+            resp.close()
+
+        vtt = to_webvtt(decode_subtitle(bytes(data))).encode('utf-8')
+        self._remove_stale(episode)
+        self.write_file(f"{base}.vtt", vtt)
+        self.write_file(f"{base}.vtt.gz", gzip.compress(vtt, compresslevel=9, mtime=0))
+        # The meta file is written last: its presence means the pair is complete
+        meta = {'etag': hashlib.sha256(vtt).hexdigest()[:32], 'source': episode.subtitle_url}
+        self.write_file(f"{base}.json", json.dumps(meta).encode('utf-8'))
+
+    def _remove_stale(self, episode):
+        directory = os.path.join(self.root, str(episode.id))
+        current = self.version(episode)
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            return
+        for name in names:
+            if not name.startswith(current):
+                try:
+                    os.remove(os.path.join(directory, name))
+                except OSError:
+                    pass
+
+
+subtitles = SubtitleStore()
+
+
+def convert_movie(movie_id):
+    """
+    Convert the subtitles of every episode of a movie ahead of the first
+    viewer. Runs as a background job; failures are logged per episode.
+    """
+    episodes = Episode.query.filter(Episode.movie_id == movie_id, Episode.subtitle_url.isnot(None),
+                                    Episode.subtitle_url != '').order_by(Episode.episode_number).all()
+    converted, failed = 0, []
+    for episode in episodes:
+        try:
+            subtitles.get(episode)
+            converted += 1
+        except (SubtitleError, requests.exceptions.RequestException) as e:
+            logger.warning("Subtitle conversion failed for episode %s: %s", episode.id, e)
+            failed.append(episode.episode_number)
+    logger.info("Converted %s subtitles of movie %s; failed for episodes %s", converted, movie_id, failed or 'none')
+    return converted, failed
@@ -0,0 +1,170 @@
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+
+from app.services.health import health, CircuitOpen
+
+# Suppress InsecureRequestWarning (upstream CDNs are fetched with verify=False)
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+# Headers required by the upstream server
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:146.0) Gecko/20100101 Firefox/146.0",
+    "Accept": "video/webm,video/ogg,video/*;q=0.9,application/ogg;q=0.7,audio/*;q=0.6,*/*;q=0.5",
+    "Accept-Language": "en-CA,en-US;q=0.7,en;q=0.3",
+    "Origin": "https://www.dracinlovers.com",
+    "Referer": "https://www.dracinlovers.com/",
+    "Sec-Fetch-Dest": "video",
+    "Sec-Fetch-Mode": "cors",
+    "Sec-Fetch-Site": "cross-site",
+    "Priority": "u=4",
+    "Te": "trailers"
+}
+
+# Headers that shouldn't be forwarded from upstream to the browser
+EXCLUDED_HEADERS = ['content-encoding', 'content-length', 'transfer-encoding', 'connection']
+
+
+class UpstreamClient:
+    """
+    Shared HTTP client for every outbound media fetch (posters, subtitles, video).
+
+    Each worker process owns one requests.Session whose adapter keeps a bounded
+    keep-alive pool per upstream host, so repeated fetches reuse TCP+TLS
+    connections instead of handshaking on every request. Every request is
+    bounded by connect/read timeouts and reported to the host health tracker.
+    """
+
+    def __init__(self):
+        self.pool_connections = 10
+        self.pool_maxsize = 20
+        self.connect_timeout = 5
+        self.read_timeout = 30
+        self.verify = False
+        self._session = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._counters = {}
+
+    def init_app(self, app):
+        self.pool_connections = app.config.get('UPSTREAM_POOL_CONNECTIONS', self.pool_connections)
+        self.pool_maxsize = app.config.get('UPSTREAM_POOL_MAXSIZE', self.pool_maxsize)
+        self.connect_timeout = app.config.get('UPSTREAM_CONNECT_TIMEOUT', self.connect_timeout)
+        self.read_timeout = app.config.get('UPSTREAM_READ_TIMEOUT', self.read_timeout)
+        self.verify = app.config.get('UPSTREAM_VERIFY_SSL', self.verify)
+        app.extensions['upstream'] = self
+
+    @property
+    def session(self):
+        # Sessions must not be shared across a fork, so every gunicorn worker
+        # builds its own pool on first use.
+        if self._session is None or self._pid != os.getpid():
+            with self._lock:
+                if self._session is None or self._pid != os.getpid():
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=self.pool_connections,
+                                          pool_maxsize=self.pool_maxsize,
+                                          max_retries=0)
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    self._session = session
+                    self._pid = os.getpid()
+                    self._counters = {}
+        return self._session
+
+    @property
+    def timeout(self):
+        return (self.connect_timeout, self.read_timeout)
+
+    def get(self, url, headers=None, stream=True, fail_on_4xx=False, **kwargs):
+        """
+        GET an upstream URL with the default media headers merged in.
+
+        Only 5xx answers count against the host by default: a missing poster
+        says nothing about the rest of the host. Callers that treat a 4xx as
+        a dead source pass fail_on_4xx=True (416 is still the range's fault).
+        """
+        request_headers = dict(DEFAULT_HEADERS)
+        if headers:
+            request_headers.update(headers)
+        kwargs.setdefault('timeout', self.timeout)
+        kwargs.setdefault('verify', self.verify)
+
+        host = urlsplit(url).netloc
+        # Fail fast instead of tying up a worker thread on a host that is down
+        if not health.allow(host):
+            self._count(host, 'errors')
+            raise CircuitOpen(f"Upstream {host} is temporarily unavailable")
+
+        started = time.monotonic()
+        try:
+            resp = self.session.get(url, headers=request_headers, stream=stream, **kwargs)
+        except requests.exceptions.RequestException:
+            self._count(host, 'errors')
+            health.record_failure(host)
+            raise
+        self._count(host, 'requests')
+        # With stream=True this returns once the headers are in: that is the TTFB
+        if resp.status_code >= 500 or (fail_on_4xx and resp.status_code >= 400 and resp.status_code != 416):
+            health.record_failure(host)
+        else:
+            health.record_success(host, time.monotonic() - started)
+        resp.upstream_host = host
+        return resp
+
+    def _count(self, host, key):
+        with self._lock:
+            counters = self._counters.setdefault(host, {'requests': 0, 'errors': 0})
+            counters[key] += 1
+
+    def stats(self):
+        """
+        Pool usage per upstream host for this worker process.
+        """
+        with self._lock:
+            result = {host: dict(counters) for host, counters in self._counters.items()}
+
+        if self._session is not None:
+            adapter = self._session.get_adapter('https://')
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                host = pool.host if pool.port in (None, 80, 443) else f"{pool.host}:{pool.port}"
+                entry = result.setdefault(host, {'requests': 0, 'errors': 0})
+                entry['connections_opened'] = pool.num_connections
+                entry['pool_requests'] = pool.num_requests
+                entry['idle_connections'] = sum(1 for conn in list(pool.pool.queue) if conn is not None) if pool.pool else 0
+                entry['pool_maxsize'] = pool.pool.maxsize if pool.pool else 0
+
+        return {'pid': os.getpid(), 'hosts': result, 'health': health.stats()}
+
+
+def iter_response(resp, chunk_size=1024*16):
+    """
+    Stream an upstream response body and always hand the connection back to
+    the pool, even when the browser disconnects mid-stream.
+    """
+    try:
+        for chunk in health.metered(resp, resp.iter_content(chunk_size=chunk_size)):
+            if chunk:
+                yield chunk
+    finally:
+        resp.close()
+
+
+def forward_headers(resp):
+    """
+    Response headers from upstream that are safe to pass to the browser.
+    """
+    return [(name, value) for (name, value) in resp.headers.items()
+            if name.lower() not in EXCLUDED_HEADERS]
+
+
+upstream = UpstreamClient()
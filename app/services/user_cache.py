@@ -0,0 +1,100 @@
+import threading
+import time
+
+from flask_login import UserMixin
+
+from app.models import User
+from app.services.stamps import stamps
+
+STAMP = 'users'
+
+# What pages and decorators read from current_user
+SNAPSHOT_FIELDS = ('id', 'email', 'name', 'profile_pic', 'role', 'subscription_end_date')
+
+
+class UserSnapshot(UserMixin):
+    """
+    Read-only copy of a User for current_user. It is not attached to a
+    session: views that change a user load the row with User.query.
+    """
+
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+    def __repr__(self):
+        return f"<UserSnapshot {self.id}>"
+
+
+class UserCache:
+    """
+    Short-lived per-process snapshots of logged-in users, so requests such
+    as proxy range calls don't query the users table just to identify the
+    viewer.
+
+    Views that change a user call invalidate(), which bumps the single
+    'users' stamp: every worker drops all its snapshots on the next request.
+    Changes to users are rare (approvals, role edits), so one shared stamp
+    keeps the stamp directory and the per-request check to a single file.
+    USER_CACHE_TTL bounds staleness for changes made outside the app.
+    """
+
+    def __init__(self):
+        self.ttl = 60
+        self.max_entries = 10000
+        self._entries = {}
+        self._stamp = None
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0}
+
+    def init_app(self, app):
+        self.ttl = app.config.get('USER_CACHE_TTL', self.ttl)
+        self.max_entries = app.config.get('USER_CACHE_MAX_ENTRIES', self.max_entries)
+        app.extensions['user_cache'] = self
+
+    def get(self, user_id):
+        stamp = stamps.read(STAMP)
+        now = time.monotonic()
+        with self._lock:
+            if stamp != self._stamp:
+                self._entries.clear()
+                self._stamp = stamp
+            entry = self._entries.get(user_id)
+            if entry and entry[1] > now:
+                self._counters['hits'] += 1
+                return entry[0]
+            self._counters['misses'] += 1
+
+        user = User.query.get(user_id)
+        if user is None:
+            return None
+        snapshot = UserSnapshot(**{field: getattr(user, field) for field in SNAPSHOT_FIELDS})
+
+        with self._lock:
+            # Not kept if a user changed while this one was loading
+            if stamp != self._stamp:
+                return snapshot
+            if len(self._entries) >= self.max_entries:
+                self._prune(now)
+            self._entries[user_id] = (snapshot, now + self.ttl)
+        return snapshot
+
+    def _prune(self, now):
+        for user_id, entry in list(self._entries.items()):
+            if entry[1] <= now:
+                del self._entries[user_id]
+        if len(self._entries) >= self.max_entries:
+            self._entries.clear()
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+        stamps.bump(STAMP)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['entries'] = len(self._entries)
+        return stats
+
+
+user_cache = UserCache()
@@ -0,0 +1,338 @@
+import hashlib
+import json
+import os
+import re
+
+from app.services.disk_cache import DiskCache
+from app.services.health import health
+from app.services.singleflight import singleflight
+from app.services.upstream import upstream
+
+VIDEO_EXTENSIONS = ('.mp4', '.m4v', '.mov', '.webm', '.mkv', '.ts', '.m4s')
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CONTENT_RANGE_RE = re.compile(r'bytes (\d+)-(\d+)/(\d+|\*)')
+
+
+class VideoCacheError(Exception):
+    pass
+
+
+class RangeNotSatisfiable(VideoCacheError):
+    def __init__(self, size):
+        super().__init__("Requested range not satisfiable")
+        self.size = size
+
+
+def parse_range(header):
+    """
+    Parse a single-range `Range` header into (start, end); end may be None.
+    Returns None for missing, multi-range or malformed headers.
+    """
+    if not header:
+        return None
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if not start:
+        # Suffix range ("last N bytes") is resolved once the size is known
+        return (-int(end), None)
+    return (int(start), int(end) if end else None)
+
+
+class VideoCache(DiskCache):
+    """
+    Block-level disk cache for video files.
+
+    Files are split into fixed-size blocks stored as
+    `<root>/<url hash>/<block index>.blk` next to a `meta.json` with the total
+    size and upstream headers. Any byte range is answered from cached blocks;
+    only the missing blocks are fetched upstream, in runs of at most
+    VIDEO_CACHE_FETCH_BLOCKS per request.
+    """
+
+    def __init__(self):
+        super().__init__(max_bytes=10 * 1024 * 1024 * 1024)
+        self.enabled = True
+        self.block_size = 1024 * 1024
+        self.fetch_blocks = 8
+        self._counters = {'hits': 0, 'misses': 0, 'coalesced': 0, 'bytes_from_cache': 0, 'bytes_from_upstream': 0}
+
+    def init_app(self, app):
+        self.enabled = app.config.get('VIDEO_CACHE_ENABLED', self.enabled)
+        self.root = app.config.get('VIDEO_CACHE_DIR') or os.path.join(app.instance_path, 'cache', 'video')
+        self.max_bytes = app.config.get('VIDEO_CACHE_MAX_BYTES', self.max_bytes)
+        self.block_size = app.config.get('VIDEO_CACHE_BLOCK_SIZE', self.block_size)
+        self.fetch_blocks = app.config.get('VIDEO_CACHE_FETCH_BLOCKS', self.fetch_blocks)
+        app.extensions['video_cache'] = self
+
+    def handles(self, url, range_header=None, force=False):
+        """
+        Whether a proxied URL should go through the block cache.
+        """
+        if not self.enabled:
+            return False
+        path = url.split('?', 1)[0].lower()
+        return force or bool(range_header) or path.endswith(VIDEO_EXTENSIONS)
+
+    def _dir(self, url):
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.root, key[:2], key)
+
+    def _block_path(self, url, index):
+        return os.path.join(self._dir(url), f"{index}.blk")
+
+    def meta(self, url):
+        try:
+            with open(os.path.join(self._dir(url), 'meta.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _save_meta(self, url, meta):
+        self.write_file(os.path.join(self._dir(url), 'meta.json'), json.dumps(meta).encode('utf-8'))
+
+    def _read_block(self, url, index):
+        path = self._block_path(url, index)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        self.touch(path)
+        return data
+
+    def has_block(self, url, index):
+        return os.path.exists(self._block_path(url, index))
+
+    def _fetch_run(self, url, first, last):
+        """
+        Fetch blocks first..last with one upstream Range request, storing each
+        block as soon as it is complete. Yields (index, data).
+        """
+        start = first * self.block_size
+        end = (last + 1) * self.block_size - 1
+        resp = upstream.get(url, headers={'Range': f'bytes={start}-{end}'}, fail_on_4xx=True)
+        try:
+            if resp.status_code >= 400:
+                raise VideoCacheError(f"Upstream returned {resp.status_code}")
+
+            meta = self.meta(url)
+            if meta is None:
+                meta = self._meta_from_response(resp)
+                if meta is None:
+                    raise VideoCacheError("Upstream did not report a file size")
+                self._save_meta(url, meta)
+
+            # Servers that ignore Range send the whole file from byte 0
+            skip = start if resp.status_code == 200 else 0
+            index = first
+            buffer = bytearray()
+            for chunk in health.metered(resp, resp.iter_content(chunk_size=1024*64)):
+                if skip:
+                    if len(chunk) <= skip:
+                        skip -= len(chunk)
+                        continue
+                    chunk = chunk[skip:]
+                    skip = 0
+                buffer.extend(chunk)
+                while len(buffer) >= self.block_size and index <= last:
+                    data = bytes(buffer[:self.block_size])
+                    del buffer[:self.block_size]
+                    self._store_block(url, index, data)
+                    yield index, data
+                    index += 1
+                if index > last:
+                    break
+
+            # Final short block at the end of the file
+            if buffer and index <= last and index * self.block_size + len(buffer) >= meta['size']:
+                data = bytes(buffer)
+                self._store_block(url, index, data)
+                yield index, data
+        finally:
+            resp.close()
+
+    def _meta_from_response(self, resp):
+        size = None
+        content_range = resp.headers.get('Content-Range')
+        if content_range:
+            match = CONTENT_RANGE_RE.match(content_range)
+            if match and match.group(3) != '*':
+                size = int(match.group(3))
+        elif resp.status_code == 200 and resp.headers.get('Content-Length'):
+            size = int(resp.headers['Content-Length'])
+        if size is None:
+            return None
+        return {
+            'size': size,
+            'content_type': resp.headers.get('Content-Type', 'application/octet-stream'),
+            'etag': resp.headers.get('ETag'),
+            'last_modified': resp.headers.get('Last-Modified'),
+        }
+
+    def _store_block(self, url, index, data):
+        self.write_file(self._block_path(url, index), data)
+        self._count(misses=1, bytes_from_upstream=len(data))
+
+    def _count(self, **deltas):
+        with self._lock:
+            for key, value in deltas.items():
+                self._counters[key] += value
+
+    def open_range(self, url, byte_range=None):
+        """
+        Resolve a byte range against the cache.
+
+        Returns (meta, start, end, chunks) where chunks is a lazy generator of
+        the requested bytes. Raises VideoCacheError if upstream cannot be
+        reached before any byte is produced, so callers can fall back; the
+        generator raises it if upstream fails halfway through the range.
+        """
+        start, end = byte_range or (0, None)
+        meta = self.meta(url)
+        if meta is None:
+            meta = self._prime(url, max(start, 0) // self.block_size)
+
+        size = meta['size']
+        if start < 0:
+            start = max(size + start, 0)
+        if end is None or end >= size:
+            end = size - 1
+        if start > end:
+            raise RangeNotSatisfiable(size)
+
+        return meta, start, end, self._iter_range(url, meta, start, end)
+
+    def _iter_range(self, url, meta, start, end):
+        first = start // self.block_size
+        last = end // self.block_size
+        last_block = (meta['size'] - 1) // self.block_size
+        index = first
+        while index <= last:
+            data = self._read_block(url, index)
+            if data is not None:
+                self._count(hits=1, bytes_from_cache=len(data))
+                yield self._slice(data, index, start, end)
+                index += 1
+                continue
+
+            fetched = False
+            for block_index, data in self._fetch_coalesced(url, index, min(last, last_block)):
+                fetched = True
+                yield self._slice(data, block_index, start, end)
+                index = block_index + 1
+            if not fetched:
+                # Ending the generator here would look like a complete body of
+                # the promised length; abort so the client sees a broken
+                # transfer and retries the range
+                raise VideoCacheError(f"Upstream returned no data for block {index} of {url}")
+
+    def read(self, url, start, length):
+        """
+        Read a small byte range through the cache (e.g. MP4 box headers).
+        """
+        _, _, _, chunks = self.open_range(url, (start, start + length - 1))
+        return b''.join(chunks)
+
+    def _flight_key(self, url, index):
+        return f"video:{url}#{index}"
+
+    def _prime(self, url, first):
+        """
+        Fetch the metadata (and one block) of an uncached URL. Concurrent
+        first viewers share a single upstream request.
+        """
+        def fetch():
+            for _ in self._fetch_run(url, first, first):
+                pass
+
+        singleflight.run(self._flight_key(url, first), fetch, ready=lambda: self.meta(url) is not None)
+        meta = self.meta(url)
+        if meta is None:
+            raise VideoCacheError("Could not determine file size")
+        return meta
+
+    def _fetch_coalesced(self, url, index, last):
+        """
+        Yield (index, data) for missing blocks starting at `index`. Leads the
+        upstream fetch (of the run of blocks nobody else is fetching), or waits
+        for the request/worker that already is and reads its blocks from disk.
+        """
+        run_end = self._missing_run_end(url, index, last)
+        keys = [self._flight_key(url, i) for i in range(index, run_end + 1)]
+        flight, claimed = singleflight.claim(keys)
+        if claimed:
+            try:
+                for block_index, data in self._fetch_run(url, index, index + len(claimed) - 1):
+                    flight.mark(keys[block_index - index])
+                    yield block_index, data
+            finally:
+                singleflight.release(flight, claimed)
+            return
+
+        singleflight.wait(keys[0], lambda: self.has_block(url, index))
+        data = self._read_block(url, index)
+        if data is not None:
+            self._count(hits=1, coalesced=1, bytes_from_cache=len(data))
+            yield index, data
+            return
+        # The leader failed or stalled: fetch this block ourselves
+        yield from self._fetch_run(url, index, index)
+
+    def _missing_run_end(self, url, index, last):
+        run_end = index
+        while (run_end + 1 <= last
+               and run_end - index + 1 < self.fetch_blocks
+               and not self.has_block(url, run_end + 1)):
+            run_end += 1
+        return run_end
+
+    def warm(self, url, start=0, end=None):
+        """
+        Pull bytes start..end of a URL into the cache without serving them.
+        Returns the number of bytes fetched from upstream.
+        """
+        meta = self.meta(url)
+        if meta is None:
+            meta = self._prime(url, start // self.block_size)
+
+        size = meta['size']
+        if end is None or end >= size:
+            end = size - 1
+        index = start // self.block_size
+        last = end // self.block_size
+        fetched = 0
+        while index <= last:
+            if self.has_block(url, index):
+                index += 1
+                continue
+            progressed = False
+            for block_index, data in self._fetch_coalesced(url, index, last):
+                progressed = True
+                fetched += len(data)
+                index = block_index + 1
+            if not progressed:
+                break
+        return fetched
+
+    def _slice(self, data, index, start, end):
+        offset = index * self.block_size
+        lo = max(start - offset, 0)
+        hi = min(end - offset + 1, len(data))
+        return data[lo:hi]
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+        lookups = counters['hits'] + counters['misses']
+        counters['hit_ratio'] = round(counters['hits'] / lookups, 4) if lookups else None
+        counters['bytes_saved'] = counters['bytes_from_cache']
+        counters.update(super().stats())
+        return counters
+
+
+video_cache = VideoCache()
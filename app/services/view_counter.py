@@ -0,0 +1,116 @@
+import atexit
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import case, func, update
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.models import db, Movie
+
+logger = logging.getLogger(__name__)
+
+
+class ViewCounter:
+    """
+    Buffers movie view increments in memory and writes them in one batched
+    UPDATE every VIEW_FLUSH_INTERVAL seconds, instead of a write transaction
+    on every detail page hit.
+
+    Each worker process has its own buffer and flusher thread. Buffers are
+    also flushed when the worker exits (atexit, plus gunicorn's worker_exit
+    hook), so at most one interval of views is lost if a worker is killed.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.interval = 5
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._atexit_registered = False
+        self._counters = {'flushes': 0, 'rows': 0, 'views': 0, 'errors': 0}
+
+    def init_app(self, app):
+        self.app = app
+        self.interval = app.config.get('VIEW_FLUSH_INTERVAL', self.interval)
+        app.extensions['view_counter'] = self
+        # The counter is a module singleton; every create_app() (tests, CLI)
+        # calls init_app again, and one exit flush is enough
+        if not self._atexit_registered:
+            atexit.register(self.flush)
+            self._atexit_registered = True
+
+    def _ensure_flusher(self):
+        # Threads don't survive a fork: start one per worker on first use
+        if self._thread is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._pending = {}
+            self._thread = threading.Thread(target=self._run, name='view-counter', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+    def record(self, movie_id):
+        with self._lock:
+            self._ensure_flusher()
+            self._pending[movie_id] = self._pending.get(movie_id, 0) + 1
+
+    def pending(self, movie_id):
+        with self._lock:
+            return self._pending.get(movie_id, 0)
+
+    def flush(self):
+        """
+        Write the buffered increments. On failure they are put back and
+        retried on the next flush.
+        """
+        with self._lock:
+            deltas, self._pending = self._pending, {}
+        if not deltas:
+            return 0
+
+        statement = (update(Movie)
+                     .where(Movie.id.in_(list(deltas)))
+                     .values(views=func.coalesce(Movie.views, 0) + case(deltas, value=Movie.id, else_=0))
+                     .execution_options(synchronize_session=False))
+        try:
+            with self.app.app_context():
+                db.session.execute(statement)
+                db.session.commit()
+        except SQLAlchemyError:
+            logger.exception("Flushing %d movie view counts failed", len(deltas))
+            with self._lock:
+                for movie_id, delta in deltas.items():
+                    self._pending[movie_id] = self._pending.get(movie_id, 0) + delta
+                self._counters['errors'] += 1
+            return 0
+
+        with self._lock:
+            self._counters['flushes'] += 1
+            self._counters['rows'] += len(deltas)
+            self._counters['views'] += sum(deltas.values())
+        return len(deltas)
+
+    def discard(self):
+        """
+        Drop buffered views without writing them.
+        """
+        with self._lock:
+            self._pending = {}
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['pending_movies'] = len(self._pending)
+            stats['pending_views'] = sum(self._pending.values())
+        stats['pid'] = os.getpid()
+        return stats
+
+
+view_counter = ViewCounter()
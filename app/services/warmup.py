@@ -0,0 +1,52 @@
+from flask import current_app
+
+from app.models import db, Episode
+from app.services.background import background
+from app.services.hls import is_playlist
+from app.services.mirror import mirrored_path, ranked_sources
+from app.services.mp4 import top_level_boxes, find_box
+from app.services.video_cache import video_cache
+
+
+def warm_video(url, head_bytes):
+    """
+    Pull the start of a video into the block cache, plus the moov box when it
+    sits at the end of the file (non-faststart MP4), so playback can begin
+    without a cold upstream fetch.
+    """
+    video_cache.warm(url, 0, head_bytes - 1)
+    meta = video_cache.meta(url)
+    if meta is None:
+        return
+
+    boxes = top_level_boxes(lambda offset, length: video_cache.read(url, offset, length), meta['size'])
+    moov = find_box(boxes, b'moov')
+    if moov is not None and moov.end > head_bytes:
+        video_cache.warm(url, moov.offset, moov.end - 1)
+
+
+def warm_episode(episode_id, head_bytes):
+    """
+    Warm the source an episode would be played from. Runs in the background
+    so the watch page that schedules it doesn't load the episode itself.
+    """
+    episode = db.session.get(Episode, episode_id)
+    if episode is None:
+        return
+    sources = ranked_sources(episode)
+    if not sources or mirrored_path(sources[0]) or is_playlist(sources[0]):
+        return
+    if not video_cache.has_block(sources[0], 0):
+        warm_video(sources[0], head_bytes)
+
+
+def schedule_episode_warmup(episode_id):
+    """
+    Queue a background warmup of an episode. Deduplicated per worker by the
+    background pool; the job skips sources whose first block is already
+    cached (e.g. warmed by another worker or viewer).
+    """
+    if not current_app.config.get('WARMUP_ENABLED') or not video_cache.enabled:
+        return False
+    head_bytes = current_app.config.get('WARMUP_BYTES', 4 * 1024 * 1024)
+    return background.submit_once(f'warmup-episode:{episode_id}', warm_episode, episode_id, head_bytes)
@@ -0,0 +1,174 @@
+"""
+Asyncio streaming proxy (ASGI).
+
+Long video streams are served here instead of through a gthread worker, so
+one process can multiplex thousands of viewers. Run it next to the Flask app:
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5003
+
+and route ASYNC_PROXY_URL (e.g. /stream) to it from nginx. Endpoints:
+
+    {ASYNC_PROXY_URL}/proxy?url=...       same contract as main.proxy
+    {ASYNC_PROXY_URL}/download?token=...  signed by admin.download_episode
+"""
+import asyncio
+from urllib.parse import parse_qs
+
+import httpx
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+
+from app.services.upstream import DEFAULT_HEADERS, EXCLUDED_HEADERS
+from app.services.http_cache import cache_control_for
+
+DOWNLOAD_SALT = 'stream-download'
+DOWNLOAD_TOKEN_MAX_AGE = 300
+
+# Request headers passed through to upstream
+FORWARDED_REQUEST_HEADERS = ('range', 'if-range')
+
+
+def download_serializer(secret_key):
+    return URLSafeTimedSerializer(secret_key, salt=DOWNLOAD_SALT)
+
+
+def sign_download(secret_key, url, filename):
+    """
+    Token that lets the streaming proxy serve an admin download without
+    re-checking the Flask session.
+    """
+    return download_serializer(secret_key).dumps({'url': url, 'filename': filename})
+
+
+class StreamProxy:
+    def __init__(self, config):
+        self.secret_key = config.SECRET_KEY
+        self.max_streams = getattr(config, 'ASYNC_PROXY_MAX_STREAMS', 4000)
+        self.chunk_size = getattr(config, 'ASYNC_PROXY_CHUNK_SIZE', 64 * 1024)
+        self.timeout = httpx.Timeout(getattr(config, 'UPSTREAM_READ_TIMEOUT', 30),
+                                     connect=getattr(config, 'UPSTREAM_CONNECT_TIMEOUT', 5))
+        self.limits = httpx.Limits(max_connections=self.max_streams,
+                                   max_keepalive_connections=getattr(config, 'UPSTREAM_POOL_MAXSIZE', 20))
+        self.verify = getattr(config, 'UPSTREAM_VERIFY_SSL', False)
+        self.client = None
+        self.semaphore = None
+        self.active_streams = 0
+
+    async def startup(self):
+        self.client = httpx.AsyncClient(headers=DEFAULT_HEADERS, timeout=self.timeout,
+                                        limits=self.limits, verify=self.verify)
+        self.semaphore = asyncio.Semaphore(self.max_streams)
+
+    async def shutdown(self):
+        if self.client is not None:
+            await self.client.aclose()
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        if self.client is None:
+            await self.startup()
+
+        path = scope['path'].rstrip('/')
+        query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+        headers = {name.decode('latin-1').lower(): value.decode('latin-1')
+                   for name, value in scope.get('headers', [])}
+
+        if path.endswith('/proxy'):
+            url = query.get('url', [None])[0]
+            if not url:
+                await self._plain(send, 400, 'URL is required')
+                return
+            await self._stream(url, headers, receive, send)
+        elif path.endswith('/download'):
+            token = query.get('token', [None])[0]
+            try:
+                data = download_serializer(self.secret_key).loads(token or '', max_age=DOWNLOAD_TOKEN_MAX_AGE)
+            except BadSignature:
+                await self._plain(send, 403, 'Invalid or expired download link')
+                return
+            extra = [(b'content-disposition', f'attachment; filename="{data["filename"]}"'.encode('latin-1', 'replace'))]
+            await self._stream(data['url'], headers, receive, send, extra_headers=extra, default_range=False)
+        elif path.endswith('/health'):
+            await self._plain(send, 200, f'ok {self.active_streams}')
+        else:
+            await self._plain(send, 404, 'Not found')
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await self.startup()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _plain(self, send, status, text):
+        body = text.encode('utf-8')
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(b'content-type', b'text/plain; charset=utf-8'),
+                                (b'content-length', str(len(body)).encode())]})
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def _stream(self, url, headers, receive, send, extra_headers=None, default_range=True):
+        if self.semaphore.locked():
+            # Shed load instead of queueing behind thousands of open streams
+            await self._plain(send, 503, 'Too many concurrent streams')
+            return
+
+        request_headers = {name: headers[name] for name in FORWARDED_REQUEST_HEADERS if name in headers}
+        if default_range and 'range' not in request_headers:
+            # Some servers require Range header for large media files
+            request_headers['range'] = 'bytes=0-'
+
+        async with self.semaphore:
+            self.active_streams += 1
+            disconnected = asyncio.Event()
+            watcher = asyncio.ensure_future(self._watch_disconnect(receive, disconnected))
+            try:
+                async with self.client.stream('GET', url, headers=request_headers) as upstream_resp:
+                    response_headers = [(name.encode('latin-1'), value.encode('latin-1'))
+                                        for name, value in upstream_resp.headers.items()
+                                        if name.lower() not in EXCLUDED_HEADERS]
+                    if 'content-length' in upstream_resp.headers:
+                        response_headers.append((b'content-length', upstream_resp.headers['content-length'].encode()))
+                    response_headers.append((b'accept-ranges', b'bytes'))
+                    if upstream_resp.status_code < 400 and 'cache-control' not in upstream_resp.headers:
+                        policy = cache_control_for(upstream_resp.headers.get('content-type'))
+                        response_headers.append((b'cache-control', policy.encode()))
+                    response_headers.extend(extra_headers or [])
+
+                    await send({'type': 'http.response.start', 'status': upstream_resp.status_code,
+                                'headers': response_headers})
+                    # send() only returns once the server has accepted the chunk, so a
+                    # slow viewer throttles how fast we read from upstream.
+                    async for chunk in upstream_resp.aiter_bytes(self.chunk_size):
+                        if disconnected.is_set():
+                            break
+                        await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                    await send({'type': 'http.response.body', 'body': b''})
+            except httpx.HTTPError as e:
+                if not disconnected.is_set():
+                    await self._safe_error(send, f'Error fetching URL: {e}')
+            finally:
+                watcher.cancel()
+                self.active_streams -= 1
+
+    async def _safe_error(self, send, text):
+        try:
+            await self._plain(send, 502, text)
+        except Exception:
+            # Headers were already sent; the client will see a truncated body
+            pass
+
+    async def _watch_disconnect(self, receive, disconnected):
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                disconnected.set()
+                return
@@ -0,0 +1,5 @@
+from config import Config
+from app.streaming import StreamProxy
+
+# ASGI entry point for the async streaming proxy (see app/streaming.py)
+app = StreamProxy(Config)
@@ -22,3 +22,94 @@ class Config:
     # Cache Configuration
     CACHE_TYPE = 'SimpleCache'
     CACHE_DEFAULT_TIMEOUT = 300
+
+    # Upstream media client (per-worker connection pools)
+    UPSTREAM_POOL_CONNECTIONS = int(os.getenv('UPSTREAM_POOL_CONNECTIONS', 10))
+    UPSTREAM_POOL_MAXSIZE = int(os.getenv('UPSTREAM_POOL_MAXSIZE', 20))
+    UPSTREAM_CONNECT_TIMEOUT = float(os.getenv('UPSTREAM_CONNECT_TIMEOUT', 5))
+    UPSTREAM_READ_TIMEOUT = float(os.getenv('UPSTREAM_READ_TIMEOUT', 30))
+
+    # Poster cache (resized variants stored on local disk)
+    IMAGE_CACHE_DIR = os.getenv('IMAGE_CACHE_DIR')
+    IMAGE_CACHE_MAX_BYTES = int(os.getenv('IMAGE_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+    IMAGE_CACHE_MAX_AGE = int(os.getenv('IMAGE_CACHE_MAX_AGE', 30 * 24 * 3600))
+
+    # Block-level video cache for the streaming proxy
+    VIDEO_CACHE_ENABLED = os.getenv('VIDEO_CACHE_ENABLED', 'true').lower() == 'true'
+    VIDEO_CACHE_DIR = os.getenv('VIDEO_CACHE_DIR')
+    VIDEO_CACHE_MAX_BYTES = int(os.getenv('VIDEO_CACHE_MAX_BYTES', 10 * 1024 * 1024 * 1024))
+    VIDEO_CACHE_BLOCK_SIZE = int(os.getenv('VIDEO_CACHE_BLOCK_SIZE', 1024 * 1024))
+    VIDEO_CACHE_FETCH_BLOCKS = int(os.getenv('VIDEO_CACHE_FETCH_BLOCKS', 8))
+
+    # Async streaming proxy (asgi.py). Empty = stream through Flask as before
+    ASYNC_PROXY_URL = os.getenv('ASYNC_PROXY_URL', '').rstrip('/')
+    ASYNC_PROXY_MAX_STREAMS = int(os.getenv('ASYNC_PROXY_MAX_STREAMS', 4000))
+
+    # Hand media bytes to the front server: '' (off), 'x-accel' (nginx) or 'x-sendfile'
+    MEDIA_OFFLOAD = os.getenv('MEDIA_OFFLOAD', '')
+    MEDIA_OFFLOAD_ROOT = os.getenv('MEDIA_OFFLOAD_ROOT')
+    MEDIA_OFFLOAD_FILE_PREFIX = os.getenv('MEDIA_OFFLOAD_FILE_PREFIX', '/_protected/files')
+    MEDIA_OFFLOAD_UPSTREAM_PREFIX = os.getenv('MEDIA_OFFLOAD_UPSTREAM_PREFIX', '/_protected/upstream')
+
+    # Background media jobs (HLS prefetch, warmup, mirroring)
+    BACKGROUND_WORKERS = int(os.getenv('BACKGROUND_WORKERS', 4))
+    BACKGROUND_MAX_PENDING = int(os.getenv('BACKGROUND_MAX_PENDING', 64))
+    HLS_PREFETCH_SEGMENTS = int(os.getenv('HLS_PREFETCH_SEGMENTS', 3))
+
+    # Pre-fetch the start of the next episode while the current one is watched
+    WARMUP_ENABLED = os.getenv('WARMUP_ENABLED', 'true').lower() == 'true'
+    WARMUP_BYTES = int(os.getenv('WARMUP_BYTES', 4 * 1024 * 1024))
+
+    # Coalesce concurrent identical upstream fetches (within and across workers)
+    SINGLEFLIGHT_LOCK_DIR = os.getenv('SINGLEFLIGHT_LOCK_DIR')
+    SINGLEFLIGHT_WAIT_TIMEOUT = float(os.getenv('SINGLEFLIGHT_WAIT_TIMEOUT', 15))
+
+    # Converted (WebVTT, gzipped) subtitles, stored per episode
+    SUBTITLE_CACHE_DIR = os.getenv('SUBTITLE_CACHE_DIR')
+    SUBTITLE_CACHE_MAX_BYTES = int(os.getenv('SUBTITLE_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+
+    # Upstream health: circuit breaker and mirror selection
+    UPSTREAM_CIRCUIT_FAILURES = int(os.getenv('UPSTREAM_CIRCUIT_FAILURES', 5))
+    UPSTREAM_CIRCUIT_COOLDOWN = float(os.getenv('UPSTREAM_CIRCUIT_COOLDOWN', 30))
+    UPSTREAM_HEALTH_ALPHA = float(os.getenv('UPSTREAM_HEALTH_ALPHA', 0.3))
+    MIRROR_STICKY_SECONDS = int(os.getenv('MIRROR_STICKY_SECONDS', 300))
+
+    # Episode link prober (`flask probe-links`)
+    LINK_PROBE_WORKERS = int(os.getenv('LINK_PROBE_WORKERS', 8))
+    LINK_PROBE_SLOW_MS = int(os.getenv('LINK_PROBE_SLOW_MS', 3000))
+
+    # Faststart headers for MP4s with the moov box at the end
+    FASTSTART_DIR = os.getenv('FASTSTART_DIR')
+    FASTSTART_MAX_BYTES = int(os.getenv('FASTSTART_MAX_BYTES', 2 * 1024 * 1024 * 1024))
+    FASTSTART_MAX_HEADER_BYTES = int(os.getenv('FASTSTART_MAX_HEADER_BYTES', 64 * 1024 * 1024))
+    FASTSTART_SCAN_ON_SAVE = os.getenv('FASTSTART_SCAN_ON_SAVE', 'true').lower() == 'true'
+
+    # Local episode mirrors (parallel ranged downloads)
+    MIRROR_DIR = os.getenv('MIRROR_DIR')
+    MIRROR_WORKERS = int(os.getenv('MIRROR_WORKERS', 1))
+    MIRROR_CONNECTIONS = int(os.getenv('MIRROR_CONNECTIONS', 4))
+    MIRROR_PIECE_BYTES = int(os.getenv('MIRROR_PIECE_BYTES', 8 * 1024 * 1024))
+
+    # Movie view counts are buffered per worker and written in batches
+    VIEW_FLUSH_INTERVAL = float(os.getenv('VIEW_FLUSH_INTERVAL', 5))
+
+    # Version stamps that tell every worker when a per-process cache is stale
+    STAMP_DIR = os.getenv('STAMP_DIR')
+
+    # Logged-in users are loaded from a short-lived per-worker snapshot
+    USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', 60))
+    USER_CACHE_MAX_ENTRIES = int(os.getenv('USER_CACHE_MAX_ENTRIES', 10000))
+
+    # In-process movie search index (title + description, BM25 ranking)
+    SEARCH_MAX_RESULTS = int(os.getenv('SEARCH_MAX_RESULTS', 500))
+
+    # Keyset-paginated listings show a total counted at most this often
+    PAGINATION_COUNT_TTL = int(os.getenv('PAGINATION_COUNT_TTL', 60))
+    ADMIN_PER_PAGE = int(os.getenv('ADMIN_PER_PAGE', 20))
+
+    # Per-worker cache of each movie's ordered episode list (watch/detail pages)
+    EPISODE_INDEX_MAX_MOVIES = int(os.getenv('EPISODE_INDEX_MAX_MOVIES', 2000))
+
+    # Requests running more SQL statements than this are logged (0 disables);
+    # `flask check-query-plans` fails on pages over budget
+    SQL_QUERY_BUDGET = int(os.getenv('SQL_QUERY_BUDGET', 15))
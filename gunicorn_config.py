@@ -13,3 +13,8 @@ keepalive = 5
 
 # Reload code in development (opsional, matikan di production)
 reload = False
+
+def worker_exit(server, worker):
+    # Write buffered movie view counts before the worker goes away
+    from app.services.view_counter import view_counter
+    view_counter.flush()
@@ -0,0 +1,55 @@
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'add_daily_stats'
+down_revision = 'add_hot_query_indexes'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table('daily_stats',
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('signups', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('transactions', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('paid_transactions', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('revenue', sa.Numeric(precision=14, scale=2), server_default='0', nullable=False),
+        sa.Column('active_subscribers', sa.Integer(), nullable=True),
+        sa.PrimaryKeyConstraint('day')
+    )
+    op.create_table('daily_plan_revenue',
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('plan_id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('paid_transactions', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('revenue', sa.Numeric(precision=14, scale=2), server_default='0', nullable=False),
+        sa.PrimaryKeyConstraint('day', 'plan_id')
+    )
+    # Backfill (same totals as `flask rollup-stats --backfill`, which also
+    # rebuilds the active subscriber history left empty here)
+    op.execute("""
+        INSERT INTO daily_stats (day, signups, transactions, paid_transactions, revenue)
+        SELECT day, SUM(signups), SUM(transactions), SUM(paid_transactions), SUM(revenue)
+        FROM (
+            SELECT DATE(created_at) AS day, 1 AS signups, 0 AS transactions,
+                   0 AS paid_transactions, 0 AS revenue
+            FROM users WHERE created_at IS NOT NULL
+            UNION ALL
+            SELECT DATE(created_at), 0, 1,
+                   CASE WHEN status = 'paid' THEN 1 ELSE 0 END,
+                   CASE WHEN status = 'paid' THEN COALESCE(amount, 0) ELSE 0 END
+            FROM transactions WHERE created_at IS NOT NULL
+        ) AS events
+        GROUP BY day
+    """)
+    # Paid transactions without a plan are stored under plan id 0 (stats.NO_PLAN)
+    op.execute("""
+        INSERT INTO daily_plan_revenue (day, plan_id, paid_transactions, revenue)
+        SELECT DATE(created_at), COALESCE(plan_id, 0), COUNT(*), COALESCE(SUM(amount), 0)
+        FROM transactions
+        WHERE status = 'paid' AND created_at IS NOT NULL
+        GROUP BY DATE(created_at), COALESCE(plan_id, 0)
+    """)
+
+def downgrade():
+    op.drop_table('daily_plan_revenue')
+    op.drop_table('daily_stats')
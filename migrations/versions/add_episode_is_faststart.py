@@ -0,0 +1,14 @@
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'add_episode_is_faststart'
+down_revision = 'add_link_probes'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.add_column('episodes', sa.Column('is_faststart', sa.Boolean(), nullable=True))
+
+def downgrade():
+    op.drop_column('episodes', 'is_faststart')
@@ -0,0 +1,14 @@
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'add_episode_mirror_urls'
+down_revision = 'add_telegram_id'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.add_column('episodes', sa.Column('mirror_urls', sa.Text(), nullable=True))
+
+def downgrade():
+    op.drop_column('episodes', 'mirror_urls')
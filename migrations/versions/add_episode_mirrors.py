@@ -0,0 +1,30 @@
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'add_episode_mirrors'
+down_revision = 'add_episode_is_faststart'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table('episode_mirrors',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('episode_id', sa.Integer(), nullable=False),
+        sa.Column('source_url', sa.Text(), nullable=False),
+        sa.Column('path', sa.String(length=512), nullable=True),
+        sa.Column('status', sa.Enum('pending', 'downloading', 'complete', 'failed'), nullable=True),
+        sa.Column('size', sa.BigInteger(), nullable=True),
+        sa.Column('bytes_done', sa.BigInteger(), nullable=True),
+        sa.Column('sha256', sa.String(length=64), nullable=True),
+        sa.Column('error', sa.String(length=255), nullable=True),
+        sa.Column('started_at', sa.DateTime(), nullable=True),
+        sa.Column('completed_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['episode_id'], ['episodes.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('episode_id')
+    )
+
+def downgrade():
+    op.drop_table('episode_mirrors')
@@ -0,0 +1,29 @@
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'add_hot_query_indexes'
+down_revision = 'add_unique_favorites'
+branch_labels = None
+depends_on = None
+
+# Checked with `flask check-query-plans`
+INDEXES = [
+    ('movies', 'idx_movie_created', ['created_at', 'id']),
+    ('episodes', 'idx_episode_movie_number', ['movie_id', 'episode_number']),
+    ('favorites', 'idx_favorite_user_created', ['user_id', 'created_at', 'id']),
+    ('transactions', 'idx_transaction_status_created', ['status', 'created_at', 'id']),
+    ('transactions', 'idx_transaction_created', ['created_at', 'id']),
+    ('users', 'idx_user_created', ['created_at', 'id']),
+    ('users', 'idx_user_subscription_end', ['subscription_end_date']),
+]
+
+def upgrade():
+    for table, name, columns in INDEXES:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.create_index(name, columns, unique=False)
+
+def downgrade():
+    for table, name, columns in reversed(INDEXES):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_index(name)
@@ -0,0 +1,30 @@
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'add_link_probes'
+down_revision = 'add_episode_mirror_urls'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table('link_probes',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('episode_id', sa.Integer(), nullable=False),
+        sa.Column('kind', sa.Enum('video', 'mirror', 'subtitle'), nullable=False),
+        sa.Column('url', sa.Text(), nullable=False),
+        sa.Column('ok', sa.Boolean(), nullable=True),
+        sa.Column('status_code', sa.Integer(), nullable=True),
+        sa.Column('content_length', sa.BigInteger(), nullable=True),
+        sa.Column('content_type', sa.String(length=255), nullable=True),
+        sa.Column('latency_ms', sa.Integer(), nullable=True),
+        sa.Column('error', sa.String(length=255), nullable=True),
+        sa.Column('checked_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['episode_id'], ['episodes.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_link_probes_episode_id', 'link_probes', ['episode_id'], unique=False)
+
+def downgrade():
+    op.drop_index('ix_link_probes_episode_id', table_name='link_probes')
+    op.drop_table('link_probes')
@@ -0,0 +1,25 @@
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'add_movie_episode_counts'
+down_revision = 'add_episode_mirrors'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.add_column('movies', sa.Column('episode_count', sa.Integer(), nullable=False, server_default='0'))
+    op.add_column('movies', sa.Column('free_episode_count', sa.Integer(), nullable=False, server_default='0'))
+    op.add_column('movies', sa.Column('latest_episode_at', sa.DateTime(), nullable=True))
+    # Backfill (same as `flask recount-episodes`)
+    op.execute("""
+        UPDATE movies SET
+            episode_count = (SELECT COUNT(*) FROM episodes WHERE episodes.movie_id = movies.id),
+            free_episode_count = (SELECT COUNT(*) FROM episodes WHERE episodes.movie_id = movies.id AND episodes.is_free = 1),
+            latest_episode_at = (SELECT MAX(episodes.created_at) FROM episodes WHERE episodes.movie_id = movies.id)
+    """)
+
+def downgrade():
+    op.drop_column('movies', 'latest_episode_at')
+    op.drop_column('movies', 'free_episode_count')
+    op.drop_column('movies', 'episode_count')
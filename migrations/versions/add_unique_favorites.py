@@ -0,0 +1,23 @@
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'add_unique_favorites'
+down_revision = 'add_movie_episode_counts'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # Keep the oldest row of any duplicated (user_id, movie_id) pair. The
+    # derived table lets MySQL delete from the table it selects from.
+    op.execute("""
+        DELETE FROM favorites WHERE id NOT IN (
+            SELECT id FROM (SELECT MIN(id) AS id FROM favorites GROUP BY user_id, movie_id) AS keep
+        )
+    """)
+    with op.batch_alter_table('favorites', schema=None) as batch_op:
+        batch_op.create_unique_constraint('unique_fav', ['user_id', 'movie_id'])
+
+def downgrade():
+    with op.batch_alter_table('favorites', schema=None) as batch_op:
+        batch_op.drop_constraint('unique_fav', type_='unique')
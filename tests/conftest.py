@@ -0,0 +1,85 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import create_app
+from app.models import db, Movie, Episode, User, SubscriptionPlan, Transaction, Favorite
+from app.services.view_counter import view_counter
+from config import Config
+
+
+@pytest.fixture
+def app(tmp_path):
+    """
+    The app on a throwaway SQLite database, with every on-disk cache under
+    tmp_path and no upstream warmup.
+    """
+    class TestConfig(Config):
+        TESTING = True
+        WTF_CSRF_ENABLED = False
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path / 'app.db'}"
+        WARMUP_ENABLED = False
+        STAMP_DIR = str(tmp_path / 'stamps')
+        IMAGE_CACHE_DIR = str(tmp_path / 'images')
+        VIDEO_CACHE_DIR = str(tmp_path / 'video')
+        SUBTITLE_CACHE_DIR = str(tmp_path / 'subtitles')
+        FASTSTART_DIR = str(tmp_path / 'faststart')
+        SINGLEFLIGHT_LOCK_DIR = str(tmp_path / 'locks')
+        MIRROR_DIR = str(tmp_path / 'media')
+
+    app = create_app(TestConfig)
+    with app.app_context():
+        db.create_all()
+        yield app
+        # Buffered views of rendered pages would be flushed into a dropped table
+        view_counter.discard()
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def catalog(app):
+    """
+    Enough rows for every listing to have several pages: movies with
+    episodes, users with transactions, plans and favorites.
+    """
+    now = datetime.utcnow()
+    admin = User(email='admin@example.com', name='Admin', role='admin',
+                 subscription_end_date=now + timedelta(days=30), created_at=now)
+    plans = [SubscriptionPlan(name=f'Plan {days}', price=days * 1000, duration_days=days) for days in (7, 30, 365)]
+    db.session.add(admin)
+    db.session.add_all(plans)
+    db.session.flush()
+
+    movies = []
+    for i in range(30):
+        movie = Movie(title=f'Cinta {i}', description=f'Drama cinta nomor {i}', created_at=now - timedelta(hours=i))
+        db.session.add(movie)
+        movies.append(movie)
+    db.session.flush()
+    for movie in movies[:5]:
+        for number in range(1, 4):
+            db.session.add(Episode(movie_id=movie.id, episode_number=number, is_free=number == 1,
+                                   video_url=f'http://cdn.invalid/{movie.id}/{number}.mp4'))
+        movie.refresh_episode_stats()
+
+    for i in range(30):
+        user = User(email=f'user{i}@example.com', name=f'User {i}', role='customer', created_at=now - timedelta(hours=i))
+        db.session.add(user)
+        db.session.flush()
+        plan = plans[i % len(plans)]
+        db.session.add(Transaction(user_id=user.id, plan_id=plan.id, amount=plan.price,
+                                   status='paid' if i % 2 else 'pending', created_at=now - timedelta(hours=i)))
+    for movie in movies[:25]:
+        db.session.add(Favorite(user_id=admin.id, movie_id=movie.id))
+    db.session.commit()
+    return admin
+
+
+@pytest.fixture
+def admin_client(app, catalog):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(catalog.id)
+        session['_fresh'] = True
+    return client
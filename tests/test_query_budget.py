@@ -0,0 +1,31 @@
+import pytest
+
+from app import cache
+from app.services.query_budget import query_budget
+from app.services.query_plans import page_statements
+
+
+def statements_per_page(app, client, url, per_page):
+    app.config['ADMIN_PER_PAGE'] = per_page
+    # Totals are cached between requests; count them on every run
+    cache.clear()
+    status, executed = page_statements(client, [url])[url]
+    assert status == 200
+    assert query_budget.count() == len(executed)
+    return len(executed)
+
+
+@pytest.mark.parametrize('url', ['/admin/transactions', '/admin/users'])
+def test_listing_queries_do_not_grow_with_page_size(app, admin_client, url):
+    # The first request also fills the user and site settings caches
+    admin_client.get(url).close()
+    small = statements_per_page(app, admin_client, url, 5)
+    large = statements_per_page(app, admin_client, url, 20)
+    assert small == large
+    assert large <= app.config['SQL_QUERY_BUDGET']
+
+
+def test_query_count_restarts_every_request(app, admin_client):
+    admin_client.get('/admin/users').close()
+    counts = [statements_per_page(app, admin_client, '/admin/users', 20) for _ in range(3)]
+    assert counts == [counts[0]] * 3
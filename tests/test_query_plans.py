@@ -0,0 +1,26 @@
+from app.models import db
+from app.services.query_plans import page_statements, checked_statements, hot_pages, explain, plan_problems
+
+
+def test_hot_pages_use_indexes(admin_client):
+    pages = hot_pages()
+    results = page_statements(admin_client, pages)
+    assert {url: status for url, (status, _) in results.items() if status >= 400} == {}
+
+    statements = checked_statements(results)
+    assert statements
+    problems = {}
+    with db.engine.connect() as connection:
+        for statement, (url, parameters) in statements.items():
+            found = plan_problems(statement, explain(connection, statement, parameters))
+            if found:
+                problems[' '.join(statement.split())] = (url, found)
+    assert problems == {}
+
+
+def test_plan_problems_flags_scans():
+    sql = 'SELECT * FROM movies WHERE title = ? ORDER BY created_at DESC LIMIT 10'
+    assert plan_problems(sql, ['SCAN movies', 'USE TEMP B-TREE FOR ORDER BY']) == \
+        ['SCAN movies', 'USE TEMP B-TREE FOR ORDER BY']
+    assert plan_problems(sql, ['SEARCH movies USING INDEX idx_movie_created (created_at<?)']) == []
+    assert plan_problems('SELECT * FROM site_settings WHERE id = ?', ['SCAN site_settings']) == []